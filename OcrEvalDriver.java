@@ -0,0 +1,56 @@
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.security.Permission;
+
+/**
+ * Resident driver for ocr_jar_pool.py: loads eu.digitisation.Main once and
+ * evaluates one "truth\ttest\toutput" line from stdin at a time, answering
+ * "OK millis" or "ERR message" on stdout.
+ */
+public class OcrEvalDriver {
+
+    static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    public static void main(String[] args) throws IOException {
+        PrintStream protocol = System.out;
+        // anything the evaluator prints goes to the worker log, stdout is reserved for replies
+        System.setOut(System.err);
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkPermission(Permission perm) {
+            }
+
+            @Override
+            public void checkExit(int status) {
+                throw new ExitTrappedException(status);
+            }
+        });
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] paths = line.split("\t");
+            long start = System.nanoTime();
+            String reply;
+            try {
+                eu.digitisation.Main.main(new String[] {"-gt", paths[0], "-ocr", paths[1], "-o", paths[2]});
+                reply = "OK " + (System.nanoTime() - start) / 1000000;
+            } catch (ExitTrappedException e) {
+                reply = e.status == 0 ? "OK " + (System.nanoTime() - start) / 1000000 : "ERR exit status " + e.status;
+            } catch (Throwable t) {
+                reply = "ERR " + t.toString().replace('\n', ' ');
+            }
+            protocol.println(reply);
+            protocol.flush();
+        }
+    }
+}
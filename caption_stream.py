@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+from itertools import islice
+from pycaption import SCCReader, CaptionReadNoCaptions
+from pycaption.scc import get_corrected_end_time
+
+def iter_scc_lines(scc_file):
+    # same lines as content.splitlines() on the whole file, one file line at a time
+    for file_line in scc_file:
+        for line in file_line.splitlines():
+            yield line
+# end
+
+class StreamingSCCReader(SCCReader):
+    # decodes an scc file line by line and hands out each caption once nothing later in the
+    # file can change it anymore, instead of building the whole CaptionSet first. the last
+    # caption stored, and the ones pycaption may still correct, are held back until then
+
+    def finished_captions(self):
+        collection = self.caption_stash._collection
+        pending = set(map(id, self.caption_stash._still_editing))
+        pending.update(map(id, collection._last_batch))
+        num_finished = 0
+        while num_finished < len(collection) - 1 and id(collection[num_finished]) not in pending:
+            num_finished += 1
+        finished = [precap.to_real_caption() for precap in collection[:num_finished]]
+        del collection[:num_finished]
+        return finished
+
+    def iter_captions(self, lines, simulate_roll_up=False, offset=0):
+        # same captions, in the same order and with the same errors, as read(...).get_captions("en-US")
+        self.simulate_roll_up = simulate_roll_up
+        self.time_translator.offset = offset * 1000000
+        short_caption = None
+        num_captions = 0
+        for line in islice(lines, 1, None):
+            self._translate_line(line)
+            for caption in self.finished_captions():
+                if short_caption is None and 0 < caption.end - caption.start < 50000:
+                    # read() only raises once the whole file is parsed
+                    short_caption = caption
+                if short_caption is None:
+                    num_captions += 1
+                    yield caption
+        self._flush_implicit_buffers()
+
+        last_captions = [precap.to_real_caption() for precap in self.caption_stash._collection]
+        self.caption_stash._collection[:] = []
+        if short_caption is None:
+            short_caption = next((caption for caption in last_captions if 0 < caption.end - caption.start < 50000), None)
+        if short_caption is not None:
+            raise ValueError('unsupported length found in SCC input file: ' + str(short_caption))
+        if num_captions + len(last_captions) == 0:
+            raise CaptionReadNoCaptions("empty caption file")
+        last_captions[-1].end = get_corrected_end_time(last_captions[-1])
+        for caption in last_captions:
+            yield caption
+# end
+
+def write_caption_text(scc_file_path, output_file_path):
+    # "start end text" per caption, written to a temporary file that replaces the output only
+    # once the whole caption file decoded, so failures leave no output behind as before
+    tmp_path = output_file_path + ".part"
+    try:
+        with open(scc_file_path, "r") as src_file, open(tmp_path, "w") as output_file:
+            for caption_at_timestep in StreamingSCCReader().iter_captions(iter_scc_lines(src_file)):
+                output_file.write(
+                    "{} {} {}\n".format(caption_at_timestep.format_start(),
+                                        caption_at_timestep.format_end(),
+                                        caption_at_timestep.get_text()))
+        os.replace(tmp_path, output_file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+# end
+
+def caption_lines(captions):
+    # formatted lines, or the error decoding stopped with
+    try:
+        return ["{} {} {}".format(caption.format_start(), caption.format_end(), caption.get_text()) for caption in captions()]
+    except Exception as e:
+        return "{}: {}".format(type(e).__name__, e)
+# end
+
+if __name__ == "__main__":
+    # compare against decoding the whole file with SCCReader: python caption_stream.py file.scc [file.scc ...]
+    timings = {"read": 0.0, "stream": 0.0}
+    for scc_file_path in sys.argv[1:]:
+        start = time.time()
+        with open(scc_file_path, "r") as src_file:
+            expected = caption_lines(lambda: SCCReader().read(src_file.read()).get_captions("en-US"))
+        timings["read"] += time.time() - start
+        start = time.time()
+        with open(scc_file_path, "r") as src_file:
+            streamed = caption_lines(lambda: StreamingSCCReader().iter_captions(iter_scc_lines(src_file)))
+        timings["stream"] += time.time() - start
+        if expected != streamed:
+            print("mismatch: {}".format(scc_file_path))
+    print("{} files, read: {:.3f}s, stream: {:.3f}s".format(len(sys.argv[1:]), timings["read"], timings["stream"]))
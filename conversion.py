@@ -1,50 +1,152 @@
 import os
+import time
 import argparse
-import traceback
-from pycaption import SCCReader
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+import requests
+from caption_stream import write_caption_text
 from tika import parser as tika_parser
+from tika import tika as tika_server
+
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+thread_local = threading.local()
 
 def get_output_file_path(src_file_path, desired_ext, type_):
     file_name, file_ext = src_file_path.split("/")[-1].split(".")
     if not os.path.exists(os.path.join("/".join(src_file_path.split("/")[:-1]), type_)):
-        os.mkdir(os.path.join("/".join(src_file_path.split("/")[:-1]), type_))
+        # several workers may get here at once
+        os.makedirs(os.path.join("/".join(src_file_path.split("/")[:-1]), type_), exist_ok=True)
     return os.path.join("/".join(src_file_path.split("/")[:-1]), type_, file_name + desired_ext)
 
 def parse_captions(scc_file_path, desired_ext):
     assert(desired_ext == ".txt"), "caption file must output to txt file"
-    src_file = open(scc_file_path, "r")
-    pycaps = SCCReader().read(src_file.read())
-    with open(get_output_file_path(scc_file_path, desired_ext, "cc_output"), "w+") as output_file:
-        for lang, caption in pycaps._captions.items():
-            if lang == "en-US":
-                for caption_at_timestep in caption:
-                    output_file.write(
-                        "{} {} {}\n".format(caption_at_timestep.format_start(),
-                                            caption_at_timestep.format_end(),
-                                            caption_at_timestep.get_text()))
-
-def parse_doc_images(doc_img_file_path, desired_ext):
+    # decoded line by line, the en-US captions are written as they are finished
+    write_caption_text(scc_file_path, get_output_file_path(scc_file_path, desired_ext, "cc_output"))
+
+def parse_captions_batch(scc_file_paths, desired_ext):
+    # many caption files in one worker process, (seconds, error) per file
+    return timed_batch(parse_captions, scc_file_paths, desired_ext)
+
+def get_session():
+    # one keep-alive session per worker thread, its connections are reused across documents
+    session = getattr(thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        thread_local.session = session
+    return session
+
+def tika_from_file(doc_img_file_path, endpoint, timeout=None, retries=0, backoff=1.0):
+    # same request and result as tika_parser.from_file, over a reused connection and with
+    # retries on connection errors, timeouts and transient server errors
+    headers = {"Accept": "application/json",
+               "Content-Disposition": tika_server.make_content_disposition_header(doc_img_file_path)}
+    for attempt in range(retries + 1):
+        try:
+            with open(doc_img_file_path, "rb") as doc_img_file:
+                resp = get_session().put(endpoint + "/rmeta/text", data=doc_img_file, headers=headers, timeout=timeout)
+            if resp.status_code in TRANSIENT_STATUS_CODES:
+                raise requests.HTTPError("tika server returned status {}".format(resp.status_code), response=resp)
+            resp.encoding = "utf-8"
+            return tika_parser._parse((resp.status_code, resp.text))
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+
+def parse_doc_images(doc_img_file_path, desired_ext, endpoint=None, timeout=None, retries=0):
     assert(desired_ext[0] == ".txt" and desired_ext[1] == ".pkl"), "document image file must output " \
                                                                 "content to txt file and metadata info to pkl file"
-    doc_img_parsed = tika_parser.from_file(doc_img_file_path)
+    if endpoint is None:
+        doc_img_parsed = tika_parser.from_file(doc_img_file_path)
+    else:
+        doc_img_parsed = tika_from_file(doc_img_file_path, endpoint, timeout, retries)
     with open(get_output_file_path(doc_img_file_path, desired_ext[0], "ocr_output_txt"), "w") as content_output_file:
         content_output_file.writelines(doc_img_parsed["content"])
     with open(get_output_file_path(doc_img_file_path, desired_ext[1], "ocr_output_pkl"), "w") as metadata_output_file:
         metadata_output_file.writelines(doc_img_parsed["metadata"])
 
+def timed_call(func, *args):
+    # (seconds, error message or None), runs in the worker so failures come back as data
+    start = time.time()
+    try:
+        func(*args)
+        return time.time() - start, None
+    except Exception as e:
+        return time.time() - start, "{}: {}".format(type(e).__name__, e)
+
+def timed_batch(func, file_paths, *args):
+    return [timed_call(func, file_path, *args) for file_path in file_paths]
+
+def start_local_tika_server(endpoint):
+    parsed_endpoint = urlparse(endpoint)
+    return tika_server.checkTikaServer(parsed_endpoint.scheme, parsed_endpoint.hostname, parsed_endpoint.port)
+
+def convert_dir(src_dir, workers, endpoints=None, timeout=None, retries=0, max_in_flight=None):
+    # captions are parsed in a process pool, several files per task, documents are sent to tika
+    # from a thread pool with at most max_in_flight requests outstanding, spread round robin over
+    # the endpoints
+    scc_files, doc_files = [], []
+    for src_file_path in os.listdir(src_dir):
+        src_file_path = src_file_path.lower()
+        full_src_file_path = os.path.join(src_dir, src_file_path)
+        if src_file_path.endswith(".scc"):
+            scc_files.append(full_src_file_path)
+        if src_file_path.endswith(".pdf") or src_file_path.endswith(".docx") or src_file_path.endswith(".doc"):
+            doc_files.append(full_src_file_path)
+
+    if doc_files and not endpoints:
+        endpoints = [start_local_tika_server(tika_server.ServerEndpoint)]
+    in_flight = threading.BoundedSemaphore(max_in_flight or 2*workers)
+    # about four batches per worker, enough to even out files of different lengths
+    scc_batch_size = max(1, len(scc_files) // (4*workers))
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as process_pool, ThreadPoolExecutor(max_workers=workers) as thread_pool:
+        futures = {}
+        for i in range(0, len(scc_files), scc_batch_size):
+            scc_batch = scc_files[i:i + scc_batch_size]
+            futures[process_pool.submit(parse_captions_batch, scc_batch, ".txt")] = scc_batch
+        for i, full_src_file_path in enumerate(doc_files):
+            in_flight.acquire()
+            future = thread_pool.submit(timed_batch, parse_doc_images, [full_src_file_path], (".txt", ".pkl"),
+                                        endpoints[i % len(endpoints)], timeout, retries)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures[future] = [full_src_file_path]
+        for future in as_completed(futures):
+            try:
+                timings = future.result()
+            except Exception as e:
+                # the worker process itself died
+                timings = [(0.0, "{}: {}".format(type(e).__name__, e))] * len(futures[future])
+            for full_src_file_path, (seconds, error) in zip(futures[future], timings):
+                results.append((full_src_file_path, seconds, error))
+                if error is not None:
+                    print("error with {} after {:.2f}s: {}".format(full_src_file_path, seconds, error))
+    return results
+
+def print_conversion_summary(results, wall_seconds):
+    failed = [result for result in results if result[2] is not None]
+    print("converted {} of {} files in {:.2f}s".format(len(results) - len(failed), len(results), wall_seconds))
+    for full_src_file_path, seconds, error in sorted(results, key=lambda result: result[1], reverse=True)[:5]:
+        print("   {:.2f}s {}".format(seconds, full_src_file_path))
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("dir", type=str)
+    parser.add_argument("--workers", type=int, default=1, help="convert this many files concurrently")
+    parser.add_argument("--tika_endpoints", type=str, default=None, help="comma separated tika-server urls, a local tika-server is started when not given")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds to wait for one tika response")
+    parser.add_argument("--retries", type=int, default=2, help="retries per document on connection errors, timeouts and 5xx responses")
+    parser.add_argument("--max_in_flight", type=int, default=None, help="tika requests outstanding at once, twice the workers by default")
+    parser.add_argument("--report", type=str, default=None, help="write per file seconds and errors to this tsv file")
     args = parser.parse_args()
 
-    for src_file_path in os.listdir(args.dir):
-        src_file_path = src_file_path.lower()
-        try:
-            full_src_file_path = os.path.join(args.dir, src_file_path)
-            if src_file_path.endswith(".scc"):
-                parse_captions(full_src_file_path, ".txt")
-            if src_file_path.endswith(".pdf") or src_file_path.endswith(".docx") or src_file_path.endswith(".doc"):
-                parse_doc_images(full_src_file_path, (".txt", ".pkl"))
-        except Exception as e:
-            print("error with " + src_file_path, traceback.print_exc())
-            continue
+    start = time.time()
+    endpoints = args.tika_endpoints.split(",") if args.tika_endpoints else None
+    results = convert_dir(args.dir, args.workers, endpoints, args.timeout, args.retries, args.max_in_flight)
+    print_conversion_summary(results, time.time() - start)
+    if args.report is not None:
+        with open(args.report, "w") as report_file:
+            report_file.write("file\tseconds\terror\n")
+            for full_src_file_path, seconds, error in results:
+                report_file.write("{}\t{:.3f}\t{}\n".format(full_src_file_path, seconds, error or ""))
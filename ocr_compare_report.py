@@ -0,0 +1,107 @@
+import os
+import io
+from datetime import datetime
+import pandas as pd
+import ocr_report_generator as report_generator
+import ocr_stats
+
+def aggregated_cer(err_rate_per_char_df_agg):
+    return ocr_stats.aggregated_rate(err_rate_per_char_df_agg[["Substitutions", "Insertions", "Deletions"]].values,
+                                     err_rate_per_char_df_agg["Total"].values)
+# end
+
+def comparison_tables(aggregators, quarantined=(), num_resamples=ocr_stats.BOOTSTRAP_RESAMPLES):
+    # aggregators: tool -> ReportAggregator over documents keyed by their ground truth file, so the
+    # same document lines up across tools. the first tool is the baseline for the deltas
+    tools = list(aggregators)
+    baseline = tools[0]
+    per_char = {tool: aggregator.err_rate_per_char_df() for tool, aggregator in aggregators.items()}
+    grnd_to_ocr = {tool: aggregator.grnd_to_ocr_df() for tool, aggregator in aggregators.items()}
+    per_doc = {tool: aggregator.err_rate_per_doc_df() for tool, aggregator in aggregators.items()}
+
+    summary_rows = []
+    for tool in tools:
+        num_quarantined = sum(1 for tool_name, _ in quarantined if tool_name == tool)
+        if len(per_doc[tool]) == 0:
+            summary_rows.append((tool, 0, num_quarantined) + (None,)*8)
+            continue
+        stats = report_generator.calculate_stats(per_doc[tool]["CER"].values, per_doc[tool]["Characters"].values, num_resamples)
+        summary_rows.append((tool, stats["num_docs"], num_quarantined, aggregated_cer(per_char[tool]),
+                             stats["weighted_mean_ci"][0], stats["weighted_mean_ci"][1], stats["pop_mean"],
+                             stats["mean_ci"][0], stats["mean_ci"][1], stats["pop_std"], stats["median"]))
+    summary_df = pd.DataFrame(summary_rows, columns=["Tool", "Documents", "Quarantined", "Aggregated_CER", "Aggregated_CER_CI_Low", "Aggregated_CER_CI_High",
+                                                     "Mean_CER", "Mean_CER_CI_Low", "Mean_CER_CI_High", "Std_CER", "Median_CER"])
+
+    per_doc_df = None
+    for tool in tools:
+        tool_df = per_doc[tool][["filename", "CER"]].rename(columns={"filename": "Ground_Truth_File", "CER": "CER_{}".format(tool)})
+        per_doc_df = tool_df if per_doc_df is None else per_doc_df.merge(tool_df, on="Ground_Truth_File", how="outer")
+    per_doc_df = per_doc_df.sort_values("Ground_Truth_File")
+
+    per_char_df = None
+    for tool in tools:
+        tool_df = per_char[tool][["Character", "HexCode", "Total", "Error_Rate"]].rename(
+            columns={"Total": "Total_{}".format(tool), "Error_Rate": "Error_Rate_{}".format(tool)})
+        per_char_df = tool_df if per_char_df is None else per_char_df.merge(tool_df, on=["Character", "HexCode"], how="outer")
+    per_char_df = per_char_df.sort_values(["Character", "HexCode"])
+
+    confusion_df = None
+    for tool in tools:
+        tool_df = grnd_to_ocr[tool][["Ground_Truth", "OCR_Output", "total_combo"]].rename(columns={"total_combo": "total_combo_{}".format(tool)})
+        confusion_df = tool_df if confusion_df is None else confusion_df.merge(tool_df, on=["Ground_Truth", "OCR_Output"], how="outer")
+    combo_columns = ["total_combo_{}".format(tool) for tool in tools]
+    confusion_df[combo_columns] = confusion_df[combo_columns].fillna(0)
+    delta_columns = []
+    for tool in tools[1:]:
+        delta_column = "delta_{}_vs_{}".format(tool, baseline)
+        confusion_df[delta_column] = confusion_df["total_combo_{}".format(tool)] - confusion_df["total_combo_{}".format(baseline)]
+        delta_columns.append(delta_column)
+    # confusions whose counts differ most between tools first
+    if delta_columns:
+        confusion_df["max_abs_delta"] = confusion_df[delta_columns].abs().max(axis=1)
+        confusion_df = confusion_df.sort_values(["max_abs_delta", "Ground_Truth", "OCR_Output"], ascending=[False, True, True])
+    else:
+        confusion_df = confusion_df.sort_values(["Ground_Truth", "OCR_Output"])
+    return summary_df, per_doc_df, per_char_df, confusion_df
+# end
+
+def format_comparison_html(tools, iframe_cer_by_doc, quarantined, num_resamples=ocr_stats.BOOTSTRAP_RESAMPLES):
+    html_header = "<html> <head><meta http-equiv='Content-Type' content='text/html; charset=UTF-8'></head> <body>"
+    title_html = "<h2> OCR Tool Comparison: {} </h2> <p>every tool is evaluated against the same ground truth files, deltas are relative to {}. confidence intervals are 95% bootstrap intervals over {} resamples of the documents</p>".format(", ".join(tools), tools[0], num_resamples)
+    quarantine_html = ""
+    if quarantined:
+        quarantine_rows = "".join("<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(tool, os.path.basename(job.paths[1]), job.attempts, job.error) for tool, job in quarantined)
+        quarantine_html = "<h2> Quarantined Documents </h2> <p>{} documents could not be evaluated and are left out of the numbers of their tool</p> <table border='1'><tr><td>Tool</td><td>Test File</td><td>Attempts</td><td>Reason</td></tr>{}</table>".format(len(quarantined), quarantine_rows)
+    return "{} {} <h2> Graphs </h2> <div> {} </div> {} <h2> Tables </h2> <center>".format(html_header, title_html, iframe_cer_by_doc, quarantine_html)
+# end
+
+def create_comparison_report(aggregators, full_path_output_dir, plotly_uname, plotly_api_key, quarantined=(), max_rows_per_page=None,
+                             num_resamples=ocr_stats.BOOTSTRAP_RESAMPLES):
+    # quarantined: (tool, failed job) pairs
+    tools = list(aggregators)
+    summary_df, per_doc_df, per_char_df, confusion_df = comparison_tables(aggregators, quarantined, num_resamples)
+    currenttime = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    # per document cer side by side, one bar per tool
+    report_generator.tls.set_credentials_file(plotly_uname, plotly_api_key)
+    data = [report_generator.go.Bar(name=tool, x=per_doc_df["Ground_Truth_File"].tolist(), y=per_doc_df["CER_{}".format(tool)].tolist())
+            for tool in tools]
+    layout = report_generator.go.Layout(title="CER by document and tool", barmode="group",
+                                        xaxis=dict(title="Documents"), yaxis=dict(title="Character Error Rate"))
+    fig = report_generator.go.Figure(data=data, layout=layout)
+    httpplot = report_generator.py.plot(fig, filename="Grouped_Bar_CER_AcrossDocs_{}_{}".format("_".join(tools), currenttime))
+    iframe_cer_by_doc = report_generator.tls.get_embed(httpplot)
+
+    file_path = os.path.join(full_path_output_dir, "{}_comparison_report.html".format("_vs_".join(tools)))
+    with io.open(file_path, "w", encoding="utf-8") as file:
+        file.write(format_comparison_html(tools, iframe_cer_by_doc, quarantined, num_resamples))
+        # documents a tool has no result for are left empty rather than shown as nan
+        report_generator.write_tables(file, file_path,
+                                      [("CER per Tool", summary_df.fillna("")),
+                                       ("CER per Document", per_doc_df.fillna("")),
+                                       ("Error Rate Per Character", per_char_df.fillna("")),
+                                       ("Instances of OCR Failure per Tool: Ground Truth vs OCR Output", confusion_df)],
+                                      max_rows_per_page)
+        file.write(" </center> </body> </html>")
+    return file_path
+# end
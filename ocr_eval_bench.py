@@ -0,0 +1,230 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+import ocr_eval_main as eval_main
+import ocr_report_generator as report_generator
+import ocr_stats
+from ocr_report_aggregator import ReportAggregator
+
+WORDS = ["the", "of", "and", "to", "in", "is", "was", "for", "on", "with", "as", "by", "at", "from",
+         "committee", "report", "government", "minister", "amendment", "section", "paragraph", "schedule",
+         "1918", "2019", "Ottawa", "Canada", "House", "Commons", "Senate", "resolution", "vote", "member"]
+PUNCTUATION = [".", ",", ";", ":", "?", "!", "\"", "'", "(", ")", "-"]
+# common ocr confusions, truth characters -> what the engine tends to read instead
+OCR_CONFUSIONS = {"l": ["1", "I", "|"], "I": ["l", "1"], "1": ["l", "I"], "O": ["0", "Q"], "o": ["0", "c"],
+                  "0": ["O", "o"], "e": ["c", "o"], "c": ["e", "("], "m": ["rn", "nn"], "n": ["ri", "h"],
+                  "h": ["b", "li"], "i": ["l", "j"], "rn": ["m"], "S": ["5", "$"], "5": ["S"], "B": ["8", "3"],
+                  "8": ["B"], "g": ["q", "9"], "t": ["f", "l"], ",": [".", ";"], ".": [",", ""], "\"": ["''", "`"]}
+PROFILES = {
+    # weights of substitution, deletion and insertion among the errors
+    "uniform": {"sub": 1.0, "del": 1.0, "ins": 1.0, "confusions": {}},
+    "ocr": {"sub": 6.0, "del": 2.0, "ins": 1.0, "confusions": OCR_CONFUSIONS},
+}
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,;:'\"-"
+
+def make_truth_text(rng, length):
+    pieces = []
+    num_chars = 0
+    while num_chars < length:
+        word = rng.choice(WORDS)
+        if rng.random() < 0.1:
+            word += rng.choice(PUNCTUATION)
+        pieces.append(word)
+        pieces.append("\n" if rng.random() < 0.08 else " ")
+        num_chars += len(word) + 1
+    return "".join(pieces)[:length]
+# end
+
+def make_test_text(rng, truth_text, error_rate, profile):
+    # walks the truth text and damages each position with probability error_rate, picking the
+    # kind of error by the profile weights and substitutions from its confusion table when one applies
+    ops = ["sub", "del", "ins"]
+    weights = [profile["sub"], profile["del"], profile["ins"]]
+    confusions = profile["confusions"]
+    pieces = []
+    i = 0
+    while i < len(truth_text):
+        if rng.random() >= error_rate:
+            pieces.append(truth_text[i])
+            i += 1
+            continue
+        op = rng.choices(ops, weights)[0]
+        if op == "ins":
+            pieces.append(truth_text[i] + rng.choice(ALPHABET))
+            i += 1
+        elif op == "del":
+            i += 1
+        elif truth_text[i:i + 2] in confusions:
+            pieces.append(rng.choice(confusions[truth_text[i:i + 2]]))
+            i += 2
+        elif truth_text[i] in confusions:
+            pieces.append(rng.choice(confusions[truth_text[i]]))
+            i += 1
+        else:
+            pieces.append(rng.choice(ALPHABET))
+            i += 1
+    return "".join(pieces)
+# end
+
+def generate_corpus(corpus_dir, num_docs, doc_length, error_rate, profile, seed):
+    # truth files are GroundTruth_<id>_<name>.txt and test files <name>.txt, so every pair
+    # matches through the filename convention match_test_truth expects
+    rng = random.Random(seed)
+    test_dir = os.path.join(corpus_dir, "test")
+    truth_dir = os.path.join(corpus_dir, "truth")
+    for dir_path in (test_dir, truth_dir):
+        if os.path.exists(dir_path):
+            shutil.rmtree(dir_path)
+        os.makedirs(dir_path)
+    num_chars = 0
+    for doc_id in range(num_docs):
+        name = "bench_doc_{:06d}".format(doc_id)
+        truth_text = make_truth_text(rng, max(1, int(doc_length * rng.uniform(0.5, 1.5))))
+        test_text = make_test_text(rng, truth_text, error_rate, PROFILES[profile])
+        with io.open(os.path.join(truth_dir, "GroundTruth_{:05d}_{}.txt".format(doc_id, name)), "w", encoding="utf-8") as truth_file:
+            truth_file.write(truth_text)
+        with io.open(os.path.join(test_dir, name + ".txt"), "w", encoding="utf-8") as test_file:
+            test_file.write(test_text)
+        num_chars += len(truth_text)
+    return test_dir, truth_dir, num_chars
+# end
+
+def stub_plotly():
+    # create_reports uploads its graphs, the benchmark stays offline
+    report_generator.tls.set_credentials_file = lambda *args, **kwargs: None
+    report_generator.py.plot = lambda fig, filename=None, **kwargs: "https://plot.ly/~bench/{}".format(filename)
+    report_generator.tls.get_embed = lambda url, *args, **kwargs: "<iframe src='{}'></iframe>".format(url)
+# end
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+# end
+
+def time_stage(results, stage, num_items, func, *args):
+    # runs one stage with its console output swallowed and records items per second
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        value = func(*args)
+    seconds = time.perf_counter() - start
+    results.append({"stage": stage, "seconds": round(seconds, 6), "items": num_items,
+                    "items_per_second": round(num_items / seconds, 3) if seconds > 0 else None})
+    print("{:<16} {:>10.3f}s {:>8} items".format(stage, seconds, num_items))
+    return value
+# end
+
+def aggregate(report_tables):
+    aggregator = ReportAggregator()
+    for filename, master_df_grnd_to_ocr, err_rate_per_char_df in report_tables:
+        aggregator.add(filename, master_df_grnd_to_ocr, err_rate_per_char_df)
+    return aggregator.err_rate_per_doc_df(), aggregator.grnd_to_ocr_df(), aggregator.err_rate_per_char_df()
+# end
+
+def write_html(file_path, aggregated, max_rows_per_page):
+    err_rate_per_doc_df, grnd_to_ocr_df_agg, err_rate_per_char_df_agg = aggregated
+    stats = report_generator.calculate_stats(err_rate_per_doc_df["CER"].values, err_rate_per_doc_df["Characters"].values)
+    cer = ocr_stats.aggregated_rate(err_rate_per_char_df_agg[["Substitutions", "Insertions", "Deletions"]].values,
+                                    err_rate_per_char_df_agg["Total"].values)
+    report_generator.write_agg_report_html(file_path=file_path,
+                                           tables=[("Error Rate Per Character", err_rate_per_char_df_agg),
+                                                   ("Instances of OCR Failure: Ground Truth vs OCR Output", grnd_to_ocr_df_agg)],
+                                           cer=cer, iframe_graphs=["", ""], stats=stats, max_rows_per_page=max_rows_per_page)
+# end
+
+def run_benchmark(args):
+    stub_plotly()
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix="ocr_eval_bench_")
+    output_dir = os.path.join(corpus_dir, "output")
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+
+    results = []
+    test_dir, truth_dir, num_chars = time_stage(results, "generate", args.num_docs, generate_corpus, corpus_dir,
+                                                args.num_docs, args.doc_length, args.error_rate, args.profile, args.seed)
+    test_dir_contents_txt, truth_dir_contents_txt = eval_main.get_dir_contents(test_dir, truth_dir)
+    all_matches = time_stage(results, "match", len(test_dir_contents_txt), eval_main.match_test_truth,
+                             test_dir_contents_txt, truth_dir_contents_txt)
+    all_truth_test_output_w_paths = [(os.path.join(truth_dir, truth), os.path.join(test_dir, test), os.path.join(output_dir, stem + "_report.html"))
+                                     for truth, test, stem in all_matches]
+
+    # the native engine hands back tables as a generator, draining it is part of evaluating
+    time_stage(results, "evaluate", len(all_truth_test_output_w_paths),
+               lambda: list(eval_main.evaluate_pairs(args.engine, all_truth_test_output_w_paths, output_dir, args.workers) or []))
+    output_dir_content = eval_main.get_output_dir_contents(output_dir)
+    if not output_dir_content:
+        sys.exit("no pair produced a report, check that {} runs from this directory".format(args.engine))
+    if len(output_dir_content) != len(all_truth_test_output_w_paths):
+        print("warning: {} of {} pairs produced a report".format(len(output_dir_content), len(all_truth_test_output_w_paths)))
+    report_tables = time_stage(results, "parse", len(output_dir_content),
+                               lambda: list(report_generator.collect_report_tables(output_dir_content)))
+    aggregated = time_stage(results, "aggregate", len(report_tables), aggregate, report_tables)
+    time_stage(results, "write_html", len(aggregated[1]) + len(aggregated[2]), write_html,
+               os.path.join(output_dir, "bench_aggregated_report.html"), aggregated, args.max_rows_per_page)
+    time_stage(results, "create_reports", len(report_tables), report_generator.create_reports, output_dir_content,
+               output_dir, "bench", "uname", "api_key", report_tables, args.max_rows_per_page)
+
+    run = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "engine": args.engine,
+           "workers": args.workers, "num_docs": args.num_docs, "doc_length": args.doc_length, "num_chars": num_chars,
+           "error_rate": args.error_rate, "profile": args.profile, "seed": args.seed}
+    with open(args.output, "a") as output_file:
+        for result in results:
+            output_file.write(json.dumps(dict(run, **result)) + "\n")
+    if not args.keep and args.corpus_dir is None:
+        shutil.rmtree(corpus_dir)
+    return results
+# end
+
+def print_summary(results_path):
+    # fastest run of each stage per commit, oldest commit first, for runs with the same corpus settings
+    best = {}
+    commits = []
+    with open(results_path) as results_file:
+        for line in results_file:
+            result = json.loads(line)
+            if result["commit"] not in commits:
+                commits.append(result["commit"])
+            key = (result["engine"], result["num_docs"], result["doc_length"], result["error_rate"], result["profile"], result["stage"])
+            runs = best.setdefault(key, {})
+            runs[result["commit"]] = min(result["seconds"], runs.get(result["commit"], float("inf")))
+    for key in sorted(best, key=str):
+        print("{:<60} {}".format(" ".join(map(str, key)), "  ".join("{}: {:.3f}s".format(commit, best[key][commit])
+                                                                     for commit in commits if commit in best[key])))
+# end
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus_dir", type=str, default=None, help="where the synthetic corpus and reports go, a temporary directory by default")
+    parser.add_argument("--num_docs", type=int, default=100)
+    parser.add_argument("--doc_length", type=int, default=5000, help="mean characters per truth document, lengths vary by +-50%%")
+    parser.add_argument("--error_rate", type=float, default=0.05, help="probability of an error at each truth character")
+    parser.add_argument("--profile", type=str, default="ocr", choices=sorted(PROFILES), help="mix of error kinds and substitutions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", type=str, default="jar", choices=["jar", "jar_pool", "native"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--max_rows_per_page", type=int, default=None)
+    parser.add_argument("--output", type=str, default="bench_results.jsonl", help="one json line per stage is appended here")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary corpus and reports")
+    parser.add_argument("--summary", action="store_true", help="only print the results in --output side by side per commit")
+    return parser.parse_args()
+# end
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.summary:
+        print_summary(args.output)
+        sys.exit(0)
+    if args.engine != "native" and shutil.which("java") is None:
+        sys.exit("java not found, the jar engines need it (or use --engine native)")
+    run_benchmark(args)
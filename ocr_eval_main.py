@@ -1,11 +1,29 @@
 import subprocess
 import argparse
 import os
-import re
+import random
 import shutil
-from pathlib import Path
+from collections import OrderedDict
+from functools import partial
 from multiprocessing import Pool
 import ocr_report_generator as report_generator
+import ocr_report_parser as report_parser
+import ocr_native_eval as native_eval
+import ocr_stats
+from ocr_jar_pool import JarWorkerPool
+from ocr_match_index import TruthIndex, print_match_report
+from ocr_result_cache import ResultCache, file_digest
+from ocr_profiler import StageProfiler, FunctionProfiler, NULL_PROFILER, measure_call
+from ocr_scheduler import EvalScheduler, write_quarantine
+from ocr_report_aggregator import ReportAggregator
+from ocr_results_store import ResultsStoreWriter
+from ocr_compare_report import create_comparison_report
+
+# report generator functions timed by --profile_functions. extract_report_data is the non streaming
+# parser, add_report_table parses with the report parser's one by default
+HOT_FUNCTIONS = ["add_report_table", "extract_report_data", "count_confusedSpots", "get_num_instances_confusedSpots",
+                 "calculate_stats", "write_agg_report_html", "writeTable"]
+PARSER_HOT_FUNCTIONS = ["extract_report_data"]
 
 def get_args():
    parser = argparse.ArgumentParser()
@@ -15,6 +33,23 @@ def get_args():
    parser.add_argument("full_path_output_dir", type=str)
    parser.add_argument("plotly_uname", type=str, help="create a plotly accout here https://plot.ly/feed/#/")
    parser.add_argument("plotly_api_key", type=str, help="create a plotly accout here https://plot.ly/feed/#/ and generate an api key")
+   parser.add_argument("--engine", type=str, default="jar", choices=["jar", "jar_pool", "native"], help="evaluate pairs with one ocrevalUAtion jvm per document, a pool of resident jvms, or the in-process native engine")
+   parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of jvms running at once for --engine jar, resident jvms for --engine jar_pool")
+   parser.add_argument("--job_timeout", type=float, default=900, help="seconds before a jvm evaluating one pair is killed, --engine jar and jar_pool")
+   parser.add_argument("--job_memory_mb", type=int, default=None, help="maximum java heap per pair, --engine jar")
+   parser.add_argument("--job_retries", type=int, default=2, help="retries for a failed pair before it is quarantined, --engine jar")
+   parser.add_argument("--job_backoff", type=float, default=2.0, help="seconds before the first retry, doubled for every further one")
+   parser.add_argument("--cache_dir", type=str, default=os.path.join(os.getcwd(), ".ocr_eval_cache"), help="where per document results are cached between runs")
+   parser.add_argument("--cache_max_mb", type=int, default=1024, help="least recently used cache entries are evicted above this size")
+   parser.add_argument("--no-cache", dest="no_cache", action="store_true", help="evaluate every pair and leave the cache untouched")
+   parser.add_argument("--rebuild", action="store_true", help="re-evaluate every pair and overwrite its cache entry")
+   parser.add_argument("--max_rows_per_page", type=int, default=None, help="split aggregated tables longer than this into linked sub-pages")
+   parser.add_argument("--bootstrap_resamples", type=int, default=ocr_stats.BOOTSTRAP_RESAMPLES, help="resamples of the documents behind the confidence intervals in the reports, 0 skips them")
+   parser.add_argument("--long_threshold", type=int, default=native_eval.LONG_THRESHOLD, help="with --engine native, pairs with more characters than this are aligned between shared anchors in linear memory")
+   parser.add_argument("--parity_sample", type=int, default=0, help="with --engine native, also run the jar on this many random pairs and report any differences")
+   parser.add_argument("--compare", type=str, nargs=2, action="append", default=[], metavar=("TOOL", "TEST_DIR"), help="also evaluate this tool's output against the same truth dir and write one comparison report, repeat for more tools")
+   parser.add_argument("--profile", type=str, default=None, help="write wall time, cpu time and peak rss per stage and per document to this jsonl trace and print the slowest ones")
+   parser.add_argument("--profile_functions", type=str, default=None, help="run the report generator's hot functions under cProfile and dump the stats to this file")
    args = parser.parse_args()
    return args
 # end
@@ -26,17 +61,15 @@ def get_dir_contents(full_path_test_dir, full_path_truth_dir):
 # end 
 
 def get_output_dir_contents(full_path_output_dir):
-   return [os.path.join(full_path_output_dir, file) for file in os.listdir(full_path_output_dir)]
+   return [os.path.join(full_path_output_dir, file) for file in os.listdir(full_path_output_dir) if file.endswith("_report.html")]
 # end 
 
 def match_test_truth(test_dir_contents_txt, truth_dir_contents_txt):
-    get_basename = lambda file: [file, '_'.join(Path(file).stem.split('_')[2:])] # first elm will be GrouthTruth
-    truth_contents_basename = list(map(get_basename, truth_dir_contents_txt))
+    # ground truth names are indexed once, each test name is scanned once for every key it contains
+    all_matches, match_report = TruthIndex(truth_dir_contents_txt).match(test_dir_contents_txt)
 
-    all_matches = [(truth_filename, test_file, Path(test_file).stem) for truth_filename, truth_pattern in truth_contents_basename 
-                             for test_file in test_dir_contents_txt if re.search(truth_pattern.lower()[:30], test_file.lower())]
-    
     print("all_matches: {}".format(all_matches))
+    print_match_report(match_report)
     return all_matches
 # end 
 
@@ -48,33 +81,267 @@ def make_cmd(all_truth_test_output_w_paths):
 # end 
 
 def run_ocr_jar(cmd):
-    subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True).wait()
+    # the jar's console output is dropped rather than left in a pipe it could fill up and block on
+    subprocess.call(cmd, stdout=subprocess.DEVNULL, shell=True)
 # end
 
-def main():
+def run_parity_check(all_truth_test_output_w_paths, native_report_tables, full_path_output_dir, sample_size):
+   parity_dir = os.path.join(full_path_output_dir, "parity")
+   os.mkdir(parity_dir)
+   native_by_output = {tables[0]: tables for tables in native_report_tables}
+   sample = random.sample(all_truth_test_output_w_paths, min(sample_size, len(all_truth_test_output_w_paths)))
+   num_mismatched = 0
+   for truth_path, test_path, output_path in sample:
+       jar_output_path = os.path.join(parity_dir, os.path.basename(output_path))
+       run_ocr_jar(make_cmd((truth_path, test_path, jar_output_path)))
+       _, native_grnd_to_ocr, native_per_char = native_by_output[os.path.basename(output_path)]
+       differences = native_eval.compare_report_tables((native_grnd_to_ocr, native_per_char), report_generator.add_report_table(jar_output_path))
+       if differences:
+           num_mismatched += 1
+           print("parity mismatch for {}:\n   {}".format(os.path.basename(output_path), "\n   ".join(differences)))
+   print("parity check: {} of {} sampled pairs differ between native engine and jar".format(num_mismatched, len(sample)))
+# end
 
-   args = get_args()
+def evaluate_pairs(engine, all_truth_test_output_w_paths, full_path_output_dir, workers, profiler=NULL_PROFILER, scheduler=None,
+                   long_threshold=native_eval.LONG_THRESHOLD):
+   # native engine returns the report tables directly, the jar engines only leave html reports behind.
+   # the jar engines are timed here, the native engine's documents as they are pulled from it
+   report_tables = None
+   if engine == "jar_pool":
+       log_dir = os.path.join(full_path_output_dir, "jar_worker_logs")
+       if not os.path.exists(log_dir):
+           os.mkdir(log_dir)
+       # resident jvms give up on a document after the same --job_timeout as the per document ones
+       timeout = scheduler.timeout if scheduler is not None else None
+       with profiler.stage("evaluate"):
+           jar_pool = JarWorkerPool(workers, "ocrevaluation.jar", os.path.join(os.getcwd(), "build"), log_dir, timeout)
+           try:
+               jar_pool.map(all_truth_test_output_w_paths)
+               for paths, seconds in zip(all_truth_test_output_w_paths, jar_pool.seconds_per_document):
+                   profiler.record("evaluate", os.path.basename(paths[2]), {"wall_seconds": seconds})
+               jar_pool.report()
+           finally:
+               jar_pool.close()
+       # failed documents go into the reports and quarantine.tsv the same way as with --engine jar
+       if scheduler is not None:
+           scheduler.quarantined.extend(jar_pool.failed)
+           if scheduler.quarantine_path is not None:
+               write_quarantine(scheduler.quarantine_path, scheduler.quarantined)
+   elif engine == "native":
+       report_tables = iter_native_report_tables(all_truth_test_output_w_paths, profiler, long_threshold)
+   else:
+       if scheduler is None:
+           scheduler = make_scheduler(workers, full_path_output_dir)
+       with profiler.stage("evaluate"):
+           for job in scheduler.run(all_truth_test_output_w_paths):
+               profiler.record("evaluate", os.path.basename(job.paths[2]), {"wall_seconds": job.seconds})
+   return report_tables
+# end
 
-   if os.path.exists(args.full_path_output_dir):
-       shutil.rmtree(args.full_path_output_dir)
-   os.mkdir(args.full_path_output_dir)
+def make_scheduler(workers, full_path_output_dir, timeout=900, max_heap_mb=None, retries=2, backoff=2.0):
+   # jvm logs and the list of pairs that kept failing go next to the reports
+   return EvalScheduler(workers, "ocrevaluation.jar", os.path.join(full_path_output_dir, "jar_logs"), timeout=timeout,
+                        max_heap_mb=max_heap_mb, retries=retries, backoff=backoff,
+                        quarantine_path=os.path.join(full_path_output_dir, "quarantine.tsv"))
+# end
+
+def iter_native_report_tables(all_truth_test_output_w_paths, profiler=NULL_PROFILER, long_threshold=native_eval.LONG_THRESHOLD):
+   # yields each document's tables as soon as a worker finishes it. the threshold goes to the workers
+   # with every task rather than through a module global, which only forked workers would see
+   evaluate_pair = partial(native_eval.evaluate_pair, long_threshold=long_threshold)
+   pool = Pool()
+   try:
+       if profiler.enabled:
+           # waiting on the workers is the evaluation as far as this process sees it
+           for report_tables, measures in profiler.iterate("evaluate", pool.imap_unordered(partial(measure_call, evaluate_pair), all_truth_test_output_w_paths)):
+               profiler.record("evaluate", report_tables[0], measures)
+               yield report_tables
+       else:
+           for report_tables in pool.imap_unordered(evaluate_pair, all_truth_test_output_w_paths):
+               yield report_tables
+   finally:
+       pool.close()
+       pool.join()
+# end
+
+def parse_reports(output_paths, profiler=NULL_PROFILER):
+   # (output path, grnd_to_ocr_df, err_rate_per_char_df) of the jar reports that were written, parsing
+   # timed per document apart from the evaluation that wrote them
+   for output_path in output_paths:
+       if os.path.isfile(output_path):
+           with profiler.stage("parse", os.path.basename(output_path)):
+               tables = report_generator.add_report_table(output_path)
+           yield (output_path,) + tables
+# end
+
+def evaluator_version(engine, long_threshold=native_eval.LONG_THRESHOLD):
+   if engine == "native":
+       # long pairs may be aligned differently depending on the threshold
+       return "{}:long_threshold={}".format(native_eval.ENGINE_VERSION, long_threshold)
+   if os.path.isfile("ocrevaluation.jar"):
+       return "ocrevaluation.jar:" + file_digest("ocrevaluation.jar")
+   return "ocrevaluation.jar"
+# end
+
+def evaluate_pairs_cached(cache, rebuild, engine, all_truth_test_output_w_paths, full_path_output_dir, workers, profiler=NULL_PROFILER, scheduler=None,
+                         long_threshold=native_eval.LONG_THRESHOLD):
+   version = evaluator_version(engine, long_threshold)
+   misses = []
+   # cached documents are handed on first, then new ones as they are evaluated
+   for paths in all_truth_test_output_w_paths:
+       key = cache.make_key(paths[0], paths[1], version)
+       entry = None if rebuild else cache.get(key)
+       if entry is None:
+           misses.append((paths, key))
+           continue
+       report_html, master_df_grnd_to_ocr, err_rate_per_char_df = entry
+       with profiler.stage("cache", os.path.basename(paths[2])):
+           with open(paths[2], "wb") as output_file:
+               output_file.write(report_html)
+       yield os.path.basename(paths[2]), master_df_grnd_to_ocr, err_rate_per_char_df
+
+   new_report_tables = evaluate_pairs(engine, [paths for paths, _ in misses], full_path_output_dir, workers, profiler, scheduler, long_threshold)
+   if new_report_tables is None:
+       new_report_tables = ((os.path.basename(tables[0]),) + tables[1:] for tables in parse_reports([paths[2] for paths, _ in misses], profiler))
+   key_by_name = {os.path.basename(paths[2]): (paths[2], key) for paths, key in misses}
+   for tables in new_report_tables:
+       output_path, key = key_by_name[tables[0]]
+       with profiler.stage("cache"):
+           with open(output_path, "rb") as output_file:
+               cache.put(key, output_file.read(), tables[1], tables[2])
+       yield tables
+   print("cache: {} pairs reused, {} evaluated, {} entries evicted".format(cache.num_hits, len(misses), cache.evict()))
+# end
 
-   test_dir_contents_txt, truth_dir_contents_txt = get_dir_contents(full_path_test_dir=args.full_path_test_dir, full_path_truth_dir=args.full_path_truth_dir)
-   all_matches = match_test_truth(test_dir_contents_txt, truth_dir_contents_txt)
+def evaluate_shared_truth(engine, all_truth_test_output_w_paths, full_path_output_dir, workers, profiler=NULL_PROFILER, scheduler=None,
+                          long_threshold=native_eval.LONG_THRESHOLD):
+   # (output path, grnd_to_ocr_df, err_rate_per_char_df) for pairs of several tools. the native engine
+   # reads and indexes each truth file once for all tools, the jar engines run every tool's pairs in one pool
+   if engine == "native":
+       pairs_by_truth = OrderedDict()
+       for truth_path, test_path, output_path in all_truth_test_output_w_paths:
+           pairs_by_truth.setdefault(truth_path, []).append((test_path, output_path))
+       evaluate_truth_group = partial(native_eval.evaluate_truth_group, long_threshold=long_threshold)
+       pool = Pool()
+       try:
+           if profiler.enabled:
+               for results, measures in profiler.iterate("evaluate", pool.imap_unordered(partial(measure_call, evaluate_truth_group), pairs_by_truth.items())):
+                   profiler.record("evaluate", os.path.basename(results[0][0]) if results else None, measures)
+                   for report_tables in results:
+                       yield report_tables
+           else:
+               for results in pool.imap_unordered(evaluate_truth_group, pairs_by_truth.items()):
+                   for report_tables in results:
+                       yield report_tables
+       finally:
+           pool.close()
+           pool.join()
+       return
+   evaluate_pairs(engine, all_truth_test_output_w_paths, full_path_output_dir, workers, profiler, scheduler)
+   for report_tables in parse_reports([output_path for _, _, output_path in all_truth_test_output_w_paths], profiler):
+       yield report_tables
+# end
+
+def run_comparison(args, profiler, scheduler):
+   # the truth dir is listed and indexed once, each tool's reports go to a sub-directory named after it
+   tools = [(args.tool, args.full_path_test_dir)] + [tuple(tool_test_dir) for tool_test_dir in args.compare]
+   assert(len(set(tool for tool, _ in tools)) == len(tools)), "every compared tool needs its own name"
+   with profiler.stage("list_dirs"):
+       truth_dir_contents_txt = [file for file in os.listdir(args.full_path_truth_dir) if file.endswith(".txt")]
+       test_dir_contents_txt = [[file for file in os.listdir(test_dir) if file.endswith(".txt")] for _, test_dir in tools]
+   with profiler.stage("match"):
+       truth_index = TruthIndex(truth_dir_contents_txt)
+       matches = [truth_index.match(test_files) for test_files in test_dir_contents_txt]
+
+   all_truth_test_output_w_paths = []
+   document_by_output = {} # output path -> (tool, ground truth file the document is compared under)
+   for (tool, test_dir), (all_matches, match_report) in zip(tools, matches):
+       print("{}: {} matches".format(tool, len(all_matches)))
+       print_match_report(match_report)
+       tool_output_dir = os.path.join(args.full_path_output_dir, tool)
+       os.mkdir(tool_output_dir)
+       for truth_filename, test_file, test_stem in all_matches:
+           output_path = os.path.join(tool_output_dir, test_stem + "_report.html")
+           all_truth_test_output_w_paths.append((os.path.join(args.full_path_truth_dir, truth_filename), os.path.join(test_dir, test_file), output_path))
+           # a truth file matching several test files of one tool keeps them apart
+           document = truth_filename if match_report["ambiguous_truth"].get(truth_filename) is None else "{} ({})".format(truth_filename, test_file)
+           document_by_output[output_path] = (tool, document)
+
+   aggregators = OrderedDict((tool, ReportAggregator()) for tool, _ in tools)
+   store_writers = dict((tool, ResultsStoreWriter(os.path.join(args.full_path_output_dir, tool, "{}_results.npz".format(tool)), tool)) for tool, _ in tools)
+   # evaluation and parsing are timed inside as each document is pulled
+   report_tables = evaluate_shared_truth(args.engine, all_truth_test_output_w_paths, args.full_path_output_dir, args.workers, profiler, scheduler,
+                                         args.long_threshold)
+   for output_path, master_df_grnd_to_ocr, err_rate_per_char_df in report_tables:
+       tool, document = document_by_output[output_path]
+       with profiler.stage("aggregate"):
+           aggregators[tool].add(document, master_df_grnd_to_ocr, err_rate_per_char_df)
+       with profiler.stage("store"):
+           store_writers[tool].add(document, master_df_grnd_to_ocr, err_rate_per_char_df)
+   with profiler.stage("store"):
+       for store_writer in store_writers.values():
+           store_writer.save()
+   quarantined = [(document_by_output[job.paths[2]][0], job) for job in scheduler.quarantined]
+   with profiler.stage("write_html"):
+       report_path = create_comparison_report(aggregators, args.full_path_output_dir, args.plotly_uname, args.plotly_api_key,
+                                              quarantined=quarantined, max_rows_per_page=args.max_rows_per_page,
+                                              num_resamples=args.bootstrap_resamples)
+   print("comparison report: {}".format(report_path))
+# end
+
+def run_single_tool(args, profiler, scheduler):
+   with profiler.stage("list_dirs"):
+       test_dir_contents_txt, truth_dir_contents_txt = get_dir_contents(full_path_test_dir=args.full_path_test_dir, full_path_truth_dir=args.full_path_truth_dir)
+   with profiler.stage("match"):
+       all_matches = match_test_truth(test_dir_contents_txt, truth_dir_contents_txt)
    all_truth_w_paths = [os.path.join(args.full_path_truth_dir, truth[0]) for truth in all_matches]
    all_test_w_paths = [os.path.join(args.full_path_test_dir, test[1]) for test in all_matches]
    all_output_w_paths = [os.path.join(args.full_path_output_dir, output[2]+"_report.html") for output in all_matches]
    all_truth_test_output_w_paths = list(zip(all_truth_w_paths, all_test_w_paths, all_output_w_paths))
-   all_cmd = list(map(make_cmd, all_truth_test_output_w_paths))
 
-   pool = Pool()
-   pool.map(run_ocr_jar, all_cmd)
-   pool.close()
-   pool.join()
+   # the jar engines evaluate everything here, the native engine and the cache hand documents on
+   # lazily. either way evaluation, parsing and cache work are timed where they happen
+   if args.no_cache:
+       report_tables = evaluate_pairs(args.engine, all_truth_test_output_w_paths, args.full_path_output_dir, args.workers, profiler, scheduler,
+                                      args.long_threshold)
+   else:
+       cache = ResultCache(args.cache_dir, args.cache_max_mb*1024*1024)
+       report_tables = evaluate_pairs_cached(cache, args.rebuild, args.engine, all_truth_test_output_w_paths, args.full_path_output_dir, args.workers, profiler, scheduler,
+                                             args.long_threshold)
+
+   if args.engine == "native" and args.parity_sample > 0:
+       report_tables = list(report_tables)
+       run_parity_check(all_truth_test_output_w_paths, report_tables, args.full_path_output_dir, args.parity_sample)
+
+   with profiler.stage("list_dirs"):
+       output_dir_content = get_output_dir_contents(args.full_path_output_dir)
+   report_generator.create_reports(output_dir_content, args.full_path_output_dir, args.tool, args.plotly_uname, args.plotly_api_key, report_tables=report_tables, max_rows_per_page=args.max_rows_per_page, profiler=profiler, quarantined=scheduler.quarantined, num_resamples=args.bootstrap_resamples,
+                                   store_writer=ResultsStoreWriter(os.path.join(args.full_path_output_dir, "{}_results.npz".format(args.tool)), args.tool))
+# end
+
+def main():
+
+   args = get_args()
+   profiler = StageProfiler(args.profile) if args.profile else NULL_PROFILER
+   if args.profile_functions:
+       function_profiler = FunctionProfiler()
+       function_profiler.instrument(report_generator, HOT_FUNCTIONS)
+       function_profiler.instrument(report_parser, PARSER_HOT_FUNCTIONS)
+
+   if os.path.exists(args.full_path_output_dir):
+       shutil.rmtree(args.full_path_output_dir)
+   os.mkdir(args.full_path_output_dir)
 
-   output_dir_content = get_output_dir_contents(args.full_path_output_dir)
-   report_generator.create_reports(output_dir_content, args.full_path_output_dir, args.tool, args.plotly_uname, args.plotly_api_key)
+   scheduler = make_scheduler(args.workers, args.full_path_output_dir, args.job_timeout, args.job_memory_mb, args.job_retries, args.job_backoff)
+   if args.compare:
+       run_comparison(args, profiler, scheduler)
+   else:
+       run_single_tool(args, profiler, scheduler)
    print("report generation complete")
+   profiler.summary()
+   profiler.close()
+   if args.profile_functions:
+       function_profiler.dump(args.profile_functions)
 # end
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+import os
+import time
+import queue
+import threading
+import subprocess
+from ocr_scheduler import EvalJob
+
+DRIVER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "OcrEvalDriver.java")
+
+def compile_driver(jar_path, build_dir):
+    # compile the resident driver once, again only when the source is newer than the class
+    class_file = os.path.join(build_dir, "OcrEvalDriver.class")
+    if not os.path.isfile(class_file) or os.path.getmtime(class_file) < os.path.getmtime(DRIVER_SOURCE):
+        if not os.path.exists(build_dir):
+            os.makedirs(build_dir)
+        subprocess.check_call(["javac", "-cp", jar_path, "-d", build_dir, DRIVER_SOURCE])
+    return os.pathsep.join([build_dir, jar_path])
+# end
+
+class JarWorker(object):
+    # one long lived jvm evaluating pairs sent over stdin. replies are read by a thread of their own so
+    # a document the jvm hangs on can be given up after timeout seconds
+
+    def __init__(self, worker_id, classpath, log_dir, timeout=None):
+        self.worker_id = worker_id
+        self.classpath = classpath
+        self.timeout = timeout
+        self.log_path = os.path.join(log_dir, "jar_worker_{}.log".format(worker_id))
+        self.num_done = 0
+        self.num_failed = 0
+        self.num_restarts = 0
+        self.busy_seconds = 0.0
+        self.last_seconds = 0.0
+        self.last_attempts = 0
+        self.last_error = None
+        self.proc = None
+        self.start()
+
+    def start(self):
+        self.log_file = open(self.log_path, "a")
+        self.proc = subprocess.Popen(["java", "-cp", self.classpath, "OcrEvalDriver"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.log_file,
+                                     universal_newlines=True, encoding="utf-8", bufsize=1)
+        # every jvm gets its own queue, a late line from a killed one cannot be taken for a reply
+        self.replies = queue.Queue()
+        reader = threading.Thread(target=read_replies, args=(self.proc.stdout, self.replies))
+        reader.daemon = True
+        reader.start()
+
+    def stop(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+            self.proc = None
+        self.log_file.close()
+
+    def restart(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+        self.log_file.close()
+        self.num_restarts += 1
+        self.start()
+
+    def send(self, truth_test_output_w_paths):
+        # the driver's reply, "" when the jvm died, None when it did not reply within the timeout
+        try:
+            self.proc.stdin.write("\t".join(truth_test_output_w_paths) + "\n")
+            self.proc.stdin.flush()
+        except (OSError, ValueError):
+            return ""
+        try:
+            return self.replies.get(timeout=self.timeout).strip()
+        except queue.Empty:
+            return None
+
+    def evaluate(self, truth_test_output_w_paths):
+        # an empty reply means the jvm died, restart it and give the document one more try
+        start = time.time()
+        reply = ""
+        for attempt in range(2):
+            self.last_attempts = attempt + 1
+            if self.proc.poll() is not None:
+                self.restart()
+            reply = self.send(truth_test_output_w_paths)
+            if reply is None:
+                # the jvm hangs on this document, a fresh one takes the next and this one is not retried
+                self.restart()
+                reply = "timed out after {}s".format(self.timeout)
+                break
+            if reply:
+                break
+            self.restart()
+        self.last_seconds = time.time() - start
+        self.busy_seconds += self.last_seconds
+        if reply.startswith("OK"):
+            self.num_done += 1
+            return True
+        self.num_failed += 1
+        self.last_error = reply or "jvm crashed"
+        print("jar worker {} failed on {}: {}".format(self.worker_id, truth_test_output_w_paths[1], self.last_error))
+        # whatever the failed document left behind must not be parsed, cached or aggregated
+        if os.path.exists(truth_test_output_w_paths[2]):
+            os.remove(truth_test_output_w_paths[2])
+        return False
+# end
+
+def read_replies(stdout, replies):
+    # one line per document, "" once the jvm's stdout is closed
+    for line in stdout:
+        replies.put(line)
+    replies.put("")
+# end
+
+class JarWorkerPool(object):
+
+    def __init__(self, num_workers, jar_path, build_dir, log_dir, timeout=None):
+        classpath = compile_driver(jar_path, build_dir)
+        self.workers = [JarWorker(worker_id, classpath, log_dir, timeout) for worker_id in range(num_workers)]
+
+    def map(self, all_truth_test_output_w_paths):
+        jobs = queue.Queue()
+        for index, paths in enumerate(all_truth_test_output_w_paths):
+            jobs.put((index, paths))
+        results = [False]*len(all_truth_test_output_w_paths)
+        self.seconds_per_document = [0.0]*len(all_truth_test_output_w_paths)
+        # failed documents as EvalJobs, to be quarantined like the ones EvalScheduler gives up on
+        failed = {}
+
+        def feed(worker):
+            while True:
+                try:
+                    index, paths = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                results[index] = worker.evaluate(paths)
+                self.seconds_per_document[index] = worker.last_seconds
+                if not results[index]:
+                    job = EvalJob(paths)
+                    job.attempts = worker.last_attempts
+                    job.seconds = worker.last_seconds
+                    job.error = worker.last_error
+                    failed[index] = job
+
+        threads = [threading.Thread(target=feed, args=(worker,)) for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.failed = [failed[index] for index in sorted(failed)]
+        return results
+
+    def report(self):
+        for worker in self.workers:
+            throughput = worker.num_done/worker.busy_seconds if worker.busy_seconds > 0 else 0.0
+            print("jar worker {}: {} documents, {} failed, {} restarts, {:.2f} documents/sec".format(
+                  worker.worker_id, worker.num_done, worker.num_failed, worker.num_restarts, throughput))
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+# end
@@ -0,0 +1,110 @@
+import os
+import json
+import argparse
+from collections import deque
+from pathlib import Path
+
+def truth_key(truth_filename):
+    # first two fields of the ground truth name are dropped, the next 30 characters must appear in the test name
+    return '_'.join(Path(truth_filename).stem.split('_')[2:]).lower()[:30]
+# end
+
+class TruthIndex(object):
+    # built once per truth directory: key -> truth files hash map plus an aho-corasick automaton
+    # over the keys, so every test filename is scanned once for all keys it contains
+
+    def __init__(self, truth_dir_contents_txt):
+        self.truth_files = list(truth_dir_contents_txt)
+        self.truth_by_key = {}
+        for truth_filename in self.truth_files:
+            self.truth_by_key.setdefault(truth_key(truth_filename), []).append(truth_filename)
+        self.build_automaton([key for key in self.truth_by_key if key])
+
+    def build_automaton(self, keys):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for key in keys:
+            node = 0
+            for ch in key:
+                child = self.goto[node].get(ch)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][ch] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = child
+            self.out[node].append(key)
+        pending = deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self.goto[node].items():
+                pending.append(child)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(ch, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find_keys(self, test_file):
+        found = set()
+        node = 0
+        for ch in test_file.lower():
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            found.update(self.out[node])
+        if "" in self.truth_by_key:
+            # an empty key is a substring of every name
+            found.add("")
+        return found
+
+    def match(self, test_dir_contents_txt):
+        # same (truth, test, test stem) triples and order as the original nested scan,
+        # plus a report of the files that matched nothing or more than once
+        tests_by_key = {}
+        truths_by_test = {}
+        for test_file in test_dir_contents_txt:
+            for key in self.find_keys(test_file):
+                tests_by_key.setdefault(key, []).append(test_file)
+                truths_by_test.setdefault(test_file, []).extend(self.truth_by_key[key])
+
+        all_matches = []
+        tests_by_truth = {}
+        for truth_filename in self.truth_files:
+            for test_file in tests_by_key.get(truth_key(truth_filename), []):
+                all_matches.append((truth_filename, test_file, Path(test_file).stem))
+                tests_by_truth.setdefault(truth_filename, []).append(test_file)
+
+        match_report = {}
+        match_report["unmatched_truth"] = [truth_filename for truth_filename in self.truth_files if truth_filename not in tests_by_truth]
+        match_report["unmatched_test"] = [test_file for test_file in test_dir_contents_txt if test_file not in truths_by_test]
+        match_report["ambiguous_truth"] = {truth_filename: tests for truth_filename, tests in tests_by_truth.items() if len(tests) > 1}
+        match_report["ambiguous_test"] = {test_file: truths for test_file, truths in truths_by_test.items() if len(truths) > 1}
+        return all_matches, match_report
+# end
+
+def print_match_report(match_report):
+    print("unmatched truth files ({}): {}".format(len(match_report["unmatched_truth"]), match_report["unmatched_truth"]))
+    print("unmatched test files ({}): {}".format(len(match_report["unmatched_test"]), match_report["unmatched_test"]))
+    print("truth files matching several test files ({}): {}".format(len(match_report["ambiguous_truth"]), match_report["ambiguous_truth"]))
+    print("test files matching several truth files ({}): {}".format(len(match_report["ambiguous_test"]), match_report["ambiguous_test"]))
+# end
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("full_path_test_dir", type=str)
+    parser.add_argument("full_path_truth_dir", type=str)
+    parser.add_argument("--json", type=str, default=None, help="also write matches and match report to this json file")
+    args = parser.parse_args()
+
+    test_dir_contents_txt = [file for file in os.listdir(args.full_path_test_dir) if file.endswith(".txt")]
+    truth_dir_contents_txt = [file for file in os.listdir(args.full_path_truth_dir) if file.endswith(".txt")]
+    all_matches, match_report = TruthIndex(truth_dir_contents_txt).match(test_dir_contents_txt)
+    for truth_filename, test_file, _ in all_matches:
+        print("{}\t{}".format(truth_filename, test_file))
+    print_match_report(match_report)
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump({"matches": all_matches, "report": match_report}, json_file, indent=1)
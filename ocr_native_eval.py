@@ -0,0 +1,382 @@
+import io
+import os
+import re
+import html
+import bisect
+from collections import Counter
+import ocr_report_generator as report_generator
+
+ENGINE_VERSION = "native-1"
+# documents longer than this many characters (truth or test) are aligned between anchors in linear
+# memory instead of keeping every bit vector column of the full alignment
+LONG_THRESHOLD = 10000
+# length of the n-grams that pin long documents together
+ANCHOR_LENGTH = 12
+# sub-problems up to this many cells are traced back directly, larger ones are split in half
+HIRSCHBERG_CELLS = 1 << 22
+
+def build_peq(pattern):
+    # one bit mask per symbol, bit i set where pattern[i] == symbol
+    peq = {}
+    for i, symbol in enumerate(pattern):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+    return peq
+# end
+
+def edit_distance(truth, test):
+    # Myers/Hyyro bit-parallel levenshtein distance, works on strings or token lists
+    n = len(truth)
+    if n == 0:
+        return len(test)
+    peq = build_peq(truth)
+    mask = (1 << n) - 1
+    high_bit = 1 << (n - 1)
+    vp, vn, score = mask, 0, n
+    for symbol in test:
+        eq = peq.get(symbol, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        ph = (vn | ~(xh | vp)) & mask
+        mh = vp & xh
+        if ph & high_bit:
+            score += 1
+        elif mh & high_bit:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        vp = (mh | ~(xv | ph)) & mask
+        vn = ph & xv & mask
+    return score
+# end
+
+def bit_vector_columns(truth, test, peq=None):
+    # run the bit-parallel recurrence keeping the vertical (vp, vn) and horizontal (ph, mh)
+    # delta vectors of every column so the alignment can be traced back afterwards
+    n = len(truth)
+    if peq is None:
+        peq = build_peq(truth)
+    mask = (1 << n) - 1
+    vp, vn = mask, 0
+    columns = [(vp, vn, 0, 0)]
+    for symbol in test:
+        eq = peq.get(symbol, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        ph = (vn | ~(xh | vp)) & mask
+        mh = vp & xh
+        ph_shifted = (ph << 1) | 1
+        mh_shifted = mh << 1
+        vp = (mh_shifted | ~(xv | ph_shifted)) & mask
+        vn = ph_shifted & xv & mask
+        columns.append((vp, vn, ph, mh))
+    return columns
+# end
+
+def align(truth, test, peq=None):
+    # edit operations as (op, truth_char, test_char) with op one of "=", "S", "D", "I"
+    n, m = len(truth), len(test)
+    if n == 0:
+        return [("I", "", c) for c in test]
+    if m == 0:
+        return [("D", c, "") for c in truth]
+    columns = bit_vector_columns(truth, test, peq)
+
+    def vdelta(i, j):
+        vp, vn = columns[j][0], columns[j][1]
+        return ((vp >> (i - 1)) & 1) - ((vn >> (i - 1)) & 1)
+
+    def hdelta(i, j):
+        if i == 0:
+            return 1
+        ph, mh = columns[j][2], columns[j][3]
+        return ((ph >> (i - 1)) & 1) - ((mh >> (i - 1)) & 1)
+
+    ops = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0:
+            h = hdelta(i, j)
+            # D(i-1, j-1) - D(i, j)
+            diag = -h - vdelta(i, j - 1)
+            if truth[i - 1] == test[j - 1] and diag == 0:
+                ops.append(("=", truth[i - 1], test[j - 1]))
+                i, j = i - 1, j - 1
+                continue
+            if diag == -1:
+                ops.append(("S", truth[i - 1], test[j - 1]))
+                i, j = i - 1, j - 1
+                continue
+            if vdelta(i, j) == 1:
+                ops.append(("D", truth[i - 1], ""))
+                i -= 1
+                continue
+            ops.append(("I", "", test[j - 1]))
+            j -= 1
+        elif i > 0:
+            ops.append(("D", truth[i - 1], ""))
+            i -= 1
+        else:
+            ops.append(("I", "", test[j - 1]))
+            j -= 1
+    ops.reverse()
+    return ops
+# end
+
+def score_row(truth, test):
+    # last row of the levenshtein matrix, the distance of truth to every prefix of test, from the
+    # same bit-parallel recurrence as edit_distance without keeping the columns
+    n = len(truth)
+    if n == 0:
+        return list(range(len(test) + 1))
+    peq = build_peq(truth)
+    mask = (1 << n) - 1
+    high_bit = 1 << (n - 1)
+    vp, vn, score = mask, 0, n
+    scores = [score]
+    for symbol in test:
+        eq = peq.get(symbol, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        ph = (vn | ~(xh | vp)) & mask
+        mh = vp & xh
+        if ph & high_bit:
+            score += 1
+        elif mh & high_bit:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        vp = (mh | ~(xv | ph)) & mask
+        vn = ph & xv & mask
+        scores.append(score)
+    return scores
+# end
+
+def hirschberg(truth, test):
+    # optimal alignment in memory linear in the text lengths: split the truth in half, find where the
+    # test splits from the forward and reverse score rows and align both halves on their own
+    n, m = len(truth), len(test)
+    if n*m <= HIRSCHBERG_CELLS or n < 2 or m == 0:
+        return align(truth, test)
+    mid = n // 2
+    forward = score_row(truth[:mid], test)
+    backward = score_row(truth[mid:][::-1], test[::-1])
+    split = min(range(m + 1), key=lambda j: forward[j] + backward[m - j])
+    return hirschberg(truth[:mid], test[:split]) + hirschberg(truth[mid:], test[split:])
+# end
+
+def unique_ngrams(text, length):
+    # n-grams starting at a word that occur once in the text, as n-gram -> position
+    positions = {}
+    for match in re.finditer(r"(?<!\S)\S", text):
+        i = match.start()
+        gram = text[i:i + length]
+        if len(gram) == length:
+            positions[gram] = -1 if gram in positions else i
+    return positions
+# end
+
+def find_anchors(truth, test, length=ANCHOR_LENGTH):
+    # (truth position, test position, size) of stretches both texts share, in order in both. n-grams
+    # unique to each text are paired up and the longest chain increasing in both positions is kept
+    truth_grams = unique_ngrams(truth, length)
+    test_grams = unique_ngrams(test, length)
+    pairs = sorted((i, test_grams[gram]) for gram, i in truth_grams.items() if i >= 0 and test_grams.get(gram, -1) >= 0)
+    # longest increasing run of test positions by patience sorting
+    tails, tail_idx, previous = [], [], [-1]*len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos > 0:
+            previous[k] = tail_idx[pos - 1]
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = k
+    chain = []
+    k = tail_idx[-1] if tail_idx else -1
+    while k >= 0:
+        chain.append(pairs[k])
+        k = previous[k]
+    chain.reverse()
+    # overlapping n-grams on the same diagonal merge into one anchor, others would cross it
+    anchors = []
+    for i, j in chain:
+        if anchors:
+            last_i, last_j, size = anchors[-1]
+            if i < last_i + size or j < last_j + size:
+                if i - last_i == j - last_j:
+                    anchors[-1] = (last_i, last_j, i - last_i + length)
+                continue
+        anchors.append((i, j, length))
+    return anchors
+# end
+
+def align_long(truth, test, anchor_length=ANCHOR_LENGTH):
+    # same operations as align, anchors are matched as they are and only the gaps between them aligned
+    ops = []
+    truth_pos, test_pos = 0, 0
+    for i, j, size in find_anchors(truth, test, anchor_length):
+        ops.extend(hirschberg(truth[truth_pos:i], test[test_pos:j]))
+        ops.extend(("=", c, c) for c in truth[i:i + size])
+        truth_pos, test_pos = i + size, j + size
+    ops.extend(hirschberg(truth[truth_pos:], test[test_pos:]))
+    return ops
+# end
+
+def truth_counts(truth, truth_segs):
+    # occurrences of each confused truth segment, single characters from one pass over the truth
+    char_counts = Counter(truth)
+    return {truth_seg: char_counts[truth_seg] if len(truth_seg) == 1 else truth.count(truth_seg) for truth_seg in truth_segs}
+# end
+
+def confused_blocks(ops):
+    # maximal runs of non matching operations as (truth segment, test segment)
+    blocks = []
+    truth_seg, test_seg = [], []
+    for op, truth_char, test_char in ops:
+        if op == "=":
+            if truth_seg or test_seg:
+                blocks.append(("".join(truth_seg), "".join(test_seg)))
+                truth_seg, test_seg = [], []
+            continue
+        truth_seg.append(truth_char)
+        test_seg.append(test_char)
+    if truth_seg or test_seg:
+        blocks.append(("".join(truth_seg), "".join(test_seg)))
+    return blocks
+# end
+
+def char_stats(truth, ops):
+    # per character [total, insertions, substitutions, deletions], same semantics as the jar table
+    stats = {}
+    for c in truth:
+        stats.setdefault(c, [0, 0, 0, 0])[0] += 1
+    for op, truth_char, test_char in ops:
+        if op == "I":
+            stats.setdefault(test_char, [0, 0, 0, 0])[1] += 1
+        elif op == "S":
+            stats[truth_char][2] += 1
+        elif op == "D":
+            stats[truth_char][3] += 1
+    return stats
+# end
+
+def hex_code(c):
+    return "{:04X}".format(ord(c)) if len(c) == 1 else ""
+# end
+
+def char_stat_rows(stats):
+    rows = []
+    for c in sorted(stats):
+        total, ins, sub, dele = stats[c]
+        err_rate = "{:.2f}".format(100.0*(ins + sub + dele)/total) if total > 0 else "Infinity"
+        rows.append((c, hex_code(c), total, ins, sub, dele, err_rate))
+    return rows
+# end
+
+def evaluate_texts(truth, test, peq=None, long_threshold=LONG_THRESHOLD):
+    # peq of the truth may be passed in when the same truth is compared against several tests.
+    # pairs longer than long_threshold are aligned with align_long
+    if max(len(truth), len(test)) > long_threshold:
+        ops = align_long(truth, test)
+    else:
+        ops = align(truth, test, peq)
+    # only blocks with text on both sides are reported as spans, pure insertions and
+    # deletions are still counted in the per character table
+    confusedSpots_zipped = Counter(block for block in confused_blocks(ops) if block[0] and block[1])
+    total_elms_count = truth_counts(truth, set(truth_seg for truth_seg, _ in confusedSpots_zipped))
+    typeOfGuess_total = report_generator.build_analytics_for_report(confusedSpots_zipped, total_elms_count)
+    row_data = char_stat_rows(char_stats(truth, ops))
+    return ops, typeOfGuess_total, row_data
+# end
+
+def edit_cost(ops):
+    return sum(1 for op in ops if op[0] != "=")
+# end
+
+def format_diff_column(ops, side, color):
+    # render one side of the alignment the way ocrevalUAtion marks differences
+    html_parts = []
+    i = 0
+    while i < len(ops):
+        matched = ops[i][0] == "="
+        j = i
+        while j < len(ops) and (ops[j][0] == "=") == matched:
+            j += 1
+        truth_seg = "".join(op[1] for op in ops[i:j])
+        test_seg = "".join(op[2] for op in ops[i:j])
+        text = html.escape(truth_seg if side == 0 else test_seg)
+        if matched:
+            html_parts.append(text)
+        elif text and truth_seg and test_seg:
+            html_parts.append("<span title='{}'><font color='{}'>{}</font></span>".format(color, color, text))
+        elif text:
+            html_parts.append("<font color='{}'>{}</font>".format(color, text))
+        i = j
+    return "".join(html_parts)
+# end
+
+def format_report_html(truth_path, test_path, ops, row_data):
+    cer = edit_cost(ops)/max(1, sum(row[2] for row in row_data))
+    html_open = "<html><head><meta http-equiv='Content-Type' content='text/html; charset=UTF-8'></head><body>"
+    header_html = "<h2>General results</h2><p>Ground truth: {}</p><p>OCR: {}</p><p>CER: {:.2f}</p>".format(
+                  html.escape(truth_path), html.escape(test_path), 100.0*cer)
+    diff_html = "<h2>Difference spotting</h2><table border='1'><tr><th>{}</th><th>{}</th></tr><tr><td>{}</td><td>{}</td></tr></table>".format(
+                os.path.basename(truth_path), os.path.basename(test_path),
+                format_diff_column(ops, 0, "red"), format_diff_column(ops, 1, "blue"))
+    rows_html = "".join("<tr>{}</tr>".format("".join("<td>{}</td>".format(html.escape(str(elm))) for elm in row)) for row in row_data)
+    char_html = "<h2>Error rate per character and type</h2><table border='1'><tr><td>Character</td><td>Hex code</td><td>Total</td><td>Spurious</td><td>Confused</td><td>Lost</td><td>Error rate</td></tr>{}</table>".format(rows_html)
+    return "{}{}{}{}</body></html>".format(html_open, header_html, diff_html, char_html)
+# end
+
+def evaluate_pair(truth_test_output_w_paths, long_threshold=LONG_THRESHOLD):
+    # drop-in replacement for running the jar on one (truth, test, output) triple
+    truth_path, test_path, output_path = truth_test_output_w_paths
+    truth = report_generator.readData(truth_path, html=False)
+    return evaluate_test(truth_path, truth, test_path, output_path, long_threshold=long_threshold)
+# end
+
+def evaluate_test(truth_path, truth, test_path, output_path, peq=None, long_threshold=LONG_THRESHOLD):
+    test = report_generator.readData(test_path, html=False)
+    ops, typeOfGuess_total, row_data = evaluate_texts(truth, test, peq, long_threshold)
+    with io.open(output_path, "w", encoding="utf-8") as output_file:
+        output_file.write(format_report_html(truth_path, test_path, ops, row_data))
+        # same confusion table add_report_table appends to the jar's reports
+        output_file.write(report_generator.format_failure_table(typeOfGuess_total))
+    master_df_grnd_to_ocr = report_generator.format_for_dataframe_grnd_to_ocr(typeOfGuess_total)
+    rows_df = report_generator.format_for_dataframe(typeOfGuess_total=row_data)
+    return output_path.split("/")[-1], master_df_grnd_to_ocr, rows_df
+# end
+
+def evaluate_truth_group(truth_group, long_threshold=LONG_THRESHOLD):
+    # one truth file against the outputs of several tools, read and indexed once for all of them.
+    # returns (output path, grnd_to_ocr_df, err_rate_per_char_df) per test
+    truth_path, test_output_w_paths = truth_group
+    truth = report_generator.readData(truth_path, html=False)
+    # long truths are aligned between anchors, which index their gaps on their own
+    peq = build_peq(truth) if len(truth) <= long_threshold else None
+    return [(output_path,) + evaluate_test(truth_path, truth, test_path, output_path, peq, long_threshold)[1:]
+            for test_path, output_path in test_output_w_paths]
+# end
+
+def compare_report_tables(native_tables, jar_tables):
+    # list of human readable differences between the native and jar results for one document
+    native_grnd_to_ocr, native_per_char = native_tables
+    jar_grnd_to_ocr, jar_per_char = jar_tables
+    differences = []
+    columns = ["Total", "Insertions", "Substitutions", "Deletions"]
+    native_counts = native_per_char.groupby("Character")[columns].sum()
+    jar_counts = jar_per_char.groupby("Character")[columns].sum()
+    joined = native_counts.join(jar_counts, how="outer", lsuffix="_native", rsuffix="_jar").fillna(0)
+    for character, row in joined.iterrows():
+        for column in columns:
+            if row[column + "_native"] != row[column + "_jar"]:
+                differences.append("char {!r} {}: native={} jar={}".format(character, column, row[column + "_native"], row[column + "_jar"]))
+    native_pairs = Counter(dict(zip(zip(native_grnd_to_ocr["Ground_Truth"], native_grnd_to_ocr["OCR_Output"]), native_grnd_to_ocr["total_combo"])))
+    jar_pairs = Counter(dict(zip(zip(jar_grnd_to_ocr["Ground_Truth"], jar_grnd_to_ocr["OCR_Output"]), jar_grnd_to_ocr["total_combo"])))
+    for pair in sorted(set(native_pairs) | set(jar_pairs)):
+        if native_pairs[pair] != jar_pairs[pair]:
+            differences.append("pair {!r}: native={} jar={}".format(pair, native_pairs[pair], jar_pairs[pair]))
+    return differences
+# end
@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import signal
+import argparse
+import threading
+import traceback
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+import conversion
+import ocr_native_eval as native_eval
+import ocr_report_generator as report_generator
+import ocr_stats
+from ocr_match_index import TruthIndex
+from ocr_report_aggregator import ReportAggregator
+from ocr_results_store import ResultsStoreWriter
+from ocr_scheduler import EvalJob, make_jar_args, run_job, write_quarantine
+
+DONE = None # end of stream, passed down from stage to stage
+CAPTION_EXTS = (".scc",)
+DOC_EXTS = (".pdf", ".docx", ".doc")
+GRND_TO_OCR_COLUMNS = ["Ground_Truth", "OCR_Output", "total_combo", "total_occurances"]
+PER_CHAR_COLUMNS = ["Character", "HexCode", "Total", "Insertions", "Substitutions", "Deletions"]
+
+def converted_path(src_file_path):
+    # where conversion.py writes the text of a source file, text files are used as they are
+    lower_path = src_file_path.lower()
+    if lower_path.endswith(CAPTION_EXTS):
+        return conversion.get_output_file_path(src_file_path, ".txt", "cc_output")
+    if lower_path.endswith(DOC_EXTS):
+        return conversion.get_output_file_path(src_file_path, ".txt", "ocr_output_txt")
+    return src_file_path
+# end
+
+def list_sources(src_dir):
+    return sorted(os.path.join(src_dir, file) for file in os.listdir(src_dir)
+                  if file.lower().endswith(CAPTION_EXTS + DOC_EXTS + (".txt",)))
+# end
+
+def evaluate_jar_pair(job, jar_path, log_dir, timeout, max_heap_mb, retries, backoff):
+    # runs the pair's jvm, retrying like EvalScheduler, and parses its report in the same worker thread.
+    # returns the report tables, or None once the job is out of retries
+    log_path = os.path.join(log_dir, os.path.splitext(os.path.basename(job.paths[2]))[0] + ".log")
+    while True:
+        job.attempts += 1
+        start = time.time()
+        try:
+            job.error = run_job(make_jar_args(job.paths, jar_path, max_heap_mb), log_path, timeout)
+            if job.error is None and not os.path.isfile(job.paths[2]):
+                job.error = "no report written"
+        except Exception as e:
+            job.error = "{}: {}".format(type(e).__name__, e)
+        job.seconds += time.time() - start
+        if job.error is None:
+            return (os.path.basename(job.paths[2]),) + report_generator.add_report_table(job.paths[2])
+        if job.attempts > retries:
+            if os.path.exists(job.paths[2]):
+                os.remove(job.paths[2])
+            return None
+        # the worker waits out the backoff itself, a pipeline has no queue to put the pair back on
+        time.sleep(backoff*2**(job.attempts - 1))
+# end
+
+def quiet_worker():
+    # ctrl-c and kills reach the whole process group, the parent alone decides what happens then
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+# end
+
+def tables_to_json(report_tables):
+    filename, master_df_grnd_to_ocr, err_rate_per_char_df = report_tables
+    return {"filename": filename,
+            "grnd_to_ocr": master_df_grnd_to_ocr[GRND_TO_OCR_COLUMNS].values.tolist(),
+            "per_char": err_rate_per_char_df[PER_CHAR_COLUMNS].values.tolist()}
+# end
+
+def tables_from_json(event):
+    return (event["filename"], pd.DataFrame(event["grnd_to_ocr"], columns=GRND_TO_OCR_COLUMNS),
+            pd.DataFrame(event["per_char"], columns=PER_CHAR_COLUMNS))
+# end
+
+class Outstanding(object):
+    # tasks whose done callback has not returned yet. concurrent.futures.wait returns before the
+    # callbacks run, so it cannot tell when the last result has been handed on
+
+    def __init__(self):
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def add(self):
+        with self.condition:
+            self.count += 1
+
+    def done(self):
+        with self.condition:
+            self.count -= 1
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            while self.count:
+                self.condition.wait()
+# end
+
+class PipelineJournal(object):
+    # append only record of finished conversions and evaluations, one json line each, flushed as
+    # written. an interrupted run is resumed from it; a line cut short by the interruption is ignored
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.converted = {} # source file -> text file
+        self.evaluated = {} # report path -> (truth path, test path, report tables)
+        self.lock = threading.Lock()
+        cut_short = False
+        if os.path.exists(journal_path):
+            cut_short = self.load()
+        self.journal_file = open(journal_path, "a")
+        if cut_short:
+            self.journal_file.write("\n")
+
+    def load(self):
+        # returns whether the last line was cut short
+        line = ""
+        with open(self.journal_path) as journal_file:
+            for line in journal_file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event["type"] == "converted":
+                    self.converted[event["src"]] = event["test"]
+                elif event["type"] == "evaluated":
+                    self.evaluated[event["output"]] = (event["truth"], event["test"], tables_from_json(event))
+        return line != "" and not line.endswith("\n")
+
+    def write(self, event):
+        with self.lock:
+            self.journal_file.write(json.dumps(event) + "\n")
+            self.journal_file.flush()
+
+    def record_converted(self, src_file_path, test_path):
+        self.converted[src_file_path] = test_path
+        self.write({"type": "converted", "src": src_file_path, "test": test_path})
+
+    def record_evaluated(self, truth_test_output_w_paths, report_tables):
+        truth_path, test_path, output_path = truth_test_output_w_paths
+        self.write(dict(tables_to_json(report_tables), type="evaluated", truth=truth_path, test=test_path, output=output_path))
+
+    def close(self):
+        self.journal_file.close()
+# end
+
+class Pipeline(object):
+    # conversion -> matching -> evaluation -> aggregation, each stage on its own thread and handing
+    # documents on one at a time. conversions and evaluations in flight are capped by semaphores the
+    # next stage releases as it takes a result, matched pairs wait in a bounded queue, so a slow stage
+    # holds up the ones before it instead of piling up documents in memory
+
+    def __init__(self, args, journal):
+        self.args = args
+        self.journal = journal
+        self.convert_slots = threading.BoundedSemaphore(args.max_in_flight or 2*args.workers)
+        self.eval_slots = threading.BoundedSemaphore(2*args.eval_workers)
+        self.converted = queue.Queue()
+        self.pairs = queue.Queue(maxsize=args.queue_size)
+        self.results = queue.Queue()
+        self.stop = threading.Event()
+        self.failed = []
+        self.counts = {"converted": 0, "conversion_failed": 0, "unmatched": 0, "evaluated": 0, "resumed": 0}
+        self.quarantined = []
+        self.seen_outputs = set()
+        self.aggregator = ReportAggregator()
+        self.store_writer = ResultsStoreWriter(os.path.join(args.full_path_output_dir, "{}_results.npz".format(args.tool)), args.tool)
+
+    def run_stage(self, target, output_queue, *args):
+        # a stage that dies still ends the stream, so the stages after it finish and the run can report it
+        try:
+            target(*args)
+        except Exception:
+            traceback.print_exc()
+            self.failed.append(target.__name__)
+            self.stop.set()
+            output_queue.put(DONE)
+
+    def convert(self, src_files, endpoints, convert_pool, caption_pool):
+        outstanding = Outstanding()
+        for i, src_file_path in enumerate(src_files):
+            self.convert_slots.acquire()
+            if self.stop.is_set():
+                break
+            if src_file_path in self.journal.converted:
+                self.converted.put((src_file_path, self.journal.converted[src_file_path], None))
+            elif src_file_path.lower().endswith(CAPTION_EXTS):
+                outstanding.add()
+                future = caption_pool.submit(conversion.timed_call, conversion.parse_captions, src_file_path, ".txt")
+                future.add_done_callback(partial(self.conversion_done, outstanding, src_file_path))
+            elif src_file_path.lower().endswith(DOC_EXTS):
+                outstanding.add()
+                future = convert_pool.submit(conversion.timed_call, conversion.parse_doc_images, src_file_path, (".txt", ".pkl"),
+                                             endpoints[i % len(endpoints)], self.args.timeout, self.args.retries)
+                future.add_done_callback(partial(self.conversion_done, outstanding, src_file_path))
+            else:
+                self.converted.put((src_file_path, src_file_path, None))
+        outstanding.wait()
+        self.converted.put(DONE)
+
+    def conversion_done(self, outstanding, src_file_path, future):
+        try:
+            if future.cancelled():
+                return
+            try:
+                _, error = future.result()
+            except Exception as e:
+                # the worker process itself died
+                error = "{}: {}".format(type(e).__name__, e)
+            self.converted.put((src_file_path, converted_path(src_file_path), error))
+        finally:
+            outstanding.done()
+
+    def match(self, truth_index):
+        while True:
+            item = self.converted.get()
+            if item is DONE:
+                break
+            self.convert_slots.release()
+            src_file_path, test_path, error = item
+            if error is not None:
+                self.counts["conversion_failed"] += 1
+                print("error converting {}: {}".format(src_file_path, error))
+                continue
+            self.counts["converted"] += 1
+            if src_file_path != test_path and src_file_path not in self.journal.converted:
+                self.journal.record_converted(src_file_path, test_path)
+            all_matches, _ = truth_index.match([os.path.basename(test_path)])
+            if not all_matches:
+                self.counts["unmatched"] += 1
+            for truth_filename, _, test_stem in all_matches:
+                output_path = os.path.join(self.args.full_path_output_dir, test_stem + "_report.html")
+                if output_path in self.seen_outputs:
+                    # reports are named after the test file, one per test file as in ocr_eval_main
+                    print("{} matches several truth files, only the first is evaluated".format(test_path))
+                    continue
+                self.seen_outputs.add(output_path)
+                if output_path not in self.journal.evaluated:
+                    self.pairs.put((os.path.join(self.args.full_path_truth_dir, truth_filename), test_path, output_path))
+        self.pairs.put(DONE)
+
+    def evaluate(self, eval_pool):
+        outstanding = Outstanding()
+        log_dir = os.path.join(self.args.full_path_output_dir, "jar_logs")
+        while True:
+            paths = self.pairs.get()
+            if paths is DONE:
+                break
+            self.eval_slots.acquire()
+            if self.stop.is_set():
+                break
+            job = EvalJob(paths)
+            outstanding.add()
+            if self.args.engine == "native":
+                future = eval_pool.submit(native_eval.evaluate_pair, paths, self.args.long_threshold)
+            else:
+                future = eval_pool.submit(evaluate_jar_pair, job, "ocrevaluation.jar", log_dir, self.args.job_timeout,
+                                          self.args.job_memory_mb, self.args.job_retries, self.args.job_backoff)
+            future.add_done_callback(partial(self.evaluation_done, outstanding, job))
+        outstanding.wait()
+        self.results.put(DONE)
+
+    def evaluation_done(self, outstanding, job, future):
+        if not future.cancelled():
+            self.results.put((job, future))
+        outstanding.done()
+
+    def add(self, report_tables):
+        filename, master_df_grnd_to_ocr, err_rate_per_char_df = report_tables
+        self.aggregator.add(filename, master_df_grnd_to_ocr, err_rate_per_char_df)
+        self.store_writer.add(filename, master_df_grnd_to_ocr, err_rate_per_char_df)
+
+    def aggregate(self):
+        last_progress = time.time()
+        while True:
+            item = self.results.get()
+            if item is DONE:
+                break
+            self.eval_slots.release()
+            job, future = item
+            try:
+                report_tables = future.result()
+            except Exception as e:
+                job.attempts, job.error, report_tables = 1, "{}: {}".format(type(e).__name__, e), None
+            if report_tables is None:
+                self.quarantined.append(job)
+                print("quarantined {} after {} attempts: {}".format(job.paths[1], job.attempts, job.error))
+                continue
+            self.add(report_tables)
+            self.journal.record_evaluated(job.paths, report_tables)
+            self.counts["evaluated"] += 1
+            if time.time() - last_progress >= self.args.progress_interval:
+                last_progress = time.time()
+                self.print_progress()
+
+    def print_progress(self):
+        print("converted {converted} ({conversion_failed} failed, {unmatched} unmatched), evaluated {evaluated} "
+              "(+{resumed} resumed)".format(**self.counts) + ", {} quarantined".format(len(self.quarantined)))
+
+    def run(self):
+        args = self.args
+        for output_path, (truth_path, test_path, report_tables) in sorted(self.journal.evaluated.items()):
+            self.add(report_tables)
+            self.counts["resumed"] += 1
+        src_files = list_sources(args.full_path_src_dir)
+        endpoints = args.tika_endpoints.split(",") if args.tika_endpoints else None
+        if not endpoints and any(src_file_path.lower().endswith(DOC_EXTS) and src_file_path not in self.journal.converted for src_file_path in src_files):
+            endpoints = [conversion.start_local_tika_server(conversion.tika_server.ServerEndpoint)]
+        truth_index = TruthIndex([file for file in os.listdir(args.full_path_truth_dir) if file.endswith(".txt")])
+        log_dir = os.path.join(args.full_path_output_dir, "jar_logs")
+        if args.engine == "jar" and not os.path.exists(log_dir):
+            os.mkdir(log_dir)
+
+        # the pools are shut down only after a full run, an interrupted one exits without waiting on them
+        convert_pool = ThreadPoolExecutor(args.workers)
+        caption_pool = ProcessPoolExecutor(args.workers, initializer=quiet_worker)
+        eval_pool = ProcessPoolExecutor(args.eval_workers, initializer=quiet_worker) if args.engine == "native" else ThreadPoolExecutor(args.eval_workers)
+        # process pools fork all their workers on the first task, get that done before any stage thread runs
+        for pool in (caption_pool, eval_pool):
+            if isinstance(pool, ProcessPoolExecutor):
+                pool.submit(int).result()
+        stages = [threading.Thread(target=self.run_stage, args=(self.convert, self.converted, src_files, endpoints, convert_pool, caption_pool)),
+                  threading.Thread(target=self.run_stage, args=(self.match, self.pairs, truth_index)),
+                  threading.Thread(target=self.run_stage, args=(self.evaluate, self.results, eval_pool))]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+        self.aggregate()
+        for pool in (convert_pool, caption_pool, eval_pool):
+            pool.shutdown()
+        self.print_progress()
+        if self.failed:
+            sys.exit("pipeline stage failed: {}".format(", ".join(self.failed)))
+        if self.counts["evaluated"] + self.counts["resumed"] == 0:
+            sys.exit("no document was evaluated")
+        write_quarantine(os.path.join(args.full_path_output_dir, "quarantine.tsv"), self.quarantined)
+        self.store_writer.save()
+        report_generator.create_reports(None, args.full_path_output_dir, args.tool, args.plotly_uname, args.plotly_api_key,
+                                        max_rows_per_page=args.max_rows_per_page, quarantined=self.quarantined,
+                                        num_resamples=args.bootstrap_resamples, aggregator=self.aggregator)
+# end
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tool", type=str)
+    parser.add_argument("full_path_src_dir", type=str, help="documents and caption files to convert, text files are evaluated as they are")
+    parser.add_argument("full_path_truth_dir", type=str)
+    parser.add_argument("full_path_output_dir", type=str)
+    parser.add_argument("plotly_uname", type=str)
+    parser.add_argument("plotly_api_key", type=str)
+    parser.add_argument("--engine", type=str, default="jar", choices=["jar", "native"])
+    parser.add_argument("--workers", type=int, default=1, help="files converted at once")
+    parser.add_argument("--eval_workers", type=int, default=os.cpu_count(), help="pairs evaluated at once")
+    parser.add_argument("--tika_endpoints", type=str, default=None, help="comma separated tika-server urls, a local tika-server is started when not given")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds to wait for one tika response")
+    parser.add_argument("--retries", type=int, default=2, help="retries per document on connection errors, timeouts and 5xx responses")
+    parser.add_argument("--max_in_flight", type=int, default=None, help="conversions outstanding at once, twice the workers by default")
+    parser.add_argument("--queue_size", type=int, default=64, help="matched pairs waiting for evaluation at most")
+    parser.add_argument("--job_timeout", type=float, default=900, help="seconds before a jvm evaluating one pair is killed")
+    parser.add_argument("--job_memory_mb", type=int, default=None, help="maximum java heap per pair")
+    parser.add_argument("--job_retries", type=int, default=2, help="retries for a failed pair before it is quarantined")
+    parser.add_argument("--job_backoff", type=float, default=2.0, help="seconds before the first retry, doubled for every further one")
+    parser.add_argument("--long_threshold", type=int, default=native_eval.LONG_THRESHOLD, help="with --engine native, pairs with more characters than this are aligned between shared anchors")
+    parser.add_argument("--max_rows_per_page", type=int, default=None)
+    parser.add_argument("--bootstrap_resamples", type=int, default=ocr_stats.BOOTSTRAP_RESAMPLES)
+    parser.add_argument("--progress_interval", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--resume", action="store_true", help="keep the output dir and skip what its journal records as done")
+    return parser.parse_args()
+# end
+
+if __name__ == "__main__":
+    args = get_args()
+    if not args.resume and os.path.exists(args.full_path_output_dir):
+        shutil.rmtree(args.full_path_output_dir)
+    if not os.path.exists(args.full_path_output_dir):
+        os.mkdir(args.full_path_output_dir)
+    journal = PipelineJournal(os.path.join(args.full_path_output_dir, "pipeline_journal.jsonl"))
+    pipeline = Pipeline(args, journal)
+    # a kill is handled like ctrl-c
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pipeline.stop.set()
+        journal.close()
+        print("interrupted after {} documents, run again with --resume to continue".format(pipeline.counts["evaluated"] + pipeline.counts["resumed"]))
+        # every finished document is in the journal already, nothing is gained by waiting for the workers
+        os._exit(130)
+    journal.close()
+    print("report generation complete")
@@ -0,0 +1,178 @@
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import functools
+from contextlib import contextmanager, nullcontext
+
+# ru_maxrss is in kilobytes on linux and bytes on macos
+RSS_UNIT_KB = 1.0/1024 if sys.platform == "darwin" else 1.0
+
+def resource_snapshot():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {"wall": time.perf_counter(),
+            "cpu": self_usage.ru_utime + self_usage.ru_stime,
+            "child_cpu": child_usage.ru_utime + child_usage.ru_stime,
+            "peak_rss_kb": self_usage.ru_maxrss*RSS_UNIT_KB,
+            "child_peak_rss_kb": child_usage.ru_maxrss*RSS_UNIT_KB}
+# end
+
+def resource_delta(start, end):
+    # cpu of waited-for child processes (jvms, pool workers) is counted once they are reaped
+    return {"wall_seconds": end["wall"] - start["wall"],
+            "cpu_seconds": end["cpu"] - start["cpu"],
+            "child_cpu_seconds": end["child_cpu"] - start["child_cpu"],
+            "peak_rss_kb": end["peak_rss_kb"],
+            "child_peak_rss_kb": end["child_peak_rss_kb"]}
+# end
+
+def measure_call(func, arg):
+    # runs func(arg) in a pool worker and returns its value with what it cost there
+    start = resource_snapshot()
+    value = func(arg)
+    return value, resource_delta(start, resource_snapshot())
+# end
+
+class StageProfiler(object):
+    # per stage totals and per document measurements of a run, written to a jsonl trace as
+    # they happen. stages may be entered many times, e.g. once per document, and are summed
+
+    enabled = True
+
+    def __init__(self, trace_path):
+        self.trace_file = open(trace_path, "w")
+        self.stage_totals = {}
+        self.stage_order = []
+        self.documents = []
+        self.run_start = resource_snapshot()
+
+    def write(self, event):
+        self.trace_file.write(json.dumps(event) + "\n")
+        self.trace_file.flush()
+
+    def add_to_stage(self, stage, measures, calls=1):
+        totals = self.stage_totals.get(stage)
+        if totals is None:
+            totals = {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "child_cpu_seconds": 0.0, "peak_rss_kb": 0.0, "child_peak_rss_kb": 0.0}
+            self.stage_totals[stage] = totals
+            self.stage_order.append(stage)
+        totals["calls"] += calls
+        for measure in ("wall_seconds", "cpu_seconds", "child_cpu_seconds"):
+            totals[measure] += measures[measure]
+        for measure in ("peak_rss_kb", "child_peak_rss_kb"):
+            totals[measure] = max(totals[measure], measures[measure])
+
+    def record(self, stage, document, measures):
+        # a document measured somewhere else, e.g. in a pool worker; does not add to the stage totals
+        event = dict(measures, type="document", stage=stage, document=document)
+        self.documents.append(event)
+        self.write(event)
+
+    @contextmanager
+    def stage(self, stage, document=None):
+        start = resource_snapshot()
+        try:
+            yield
+        finally:
+            measures = resource_delta(start, resource_snapshot())
+            self.add_to_stage(stage, measures)
+            if document is not None:
+                self.record(stage, document, measures)
+
+    def iterate(self, stage, iterable, per_document=False):
+        # time spent producing each item of a lazy iterable goes to stage, items are (document, ...) tuples
+        iterator = iter(iterable)
+        while True:
+            start = resource_snapshot()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                # finding out the iterable is exhausted takes time but is not a call for a document
+                self.add_to_stage(stage, resource_delta(start, resource_snapshot()), calls=0)
+                return
+            measures = resource_delta(start, resource_snapshot())
+            self.add_to_stage(stage, measures)
+            if per_document:
+                self.record(stage, item[0], measures)
+            yield item
+
+    def summary(self, top=10):
+        run = resource_delta(self.run_start, resource_snapshot())
+        stages = [dict(self.stage_totals[stage], stage=stage) for stage in self.stage_order]
+        slowest_documents = sorted(self.documents, key=lambda event: event["wall_seconds"], reverse=True)[:top]
+        self.write({"type": "summary", "run": run, "stages": stages, "slowest_documents": slowest_documents})
+
+        print("profile: {:.2f}s wall, {:.2f}s cpu, {:.2f}s child cpu, {:.0f} kB peak rss".format(
+              run["wall_seconds"], run["cpu_seconds"], run["child_cpu_seconds"], run["peak_rss_kb"]))
+        for totals in sorted(stages, key=lambda totals: totals["wall_seconds"], reverse=True):
+            print("   {:<16} {:>9.3f}s wall {:>9.3f}s cpu {:>9.3f}s child cpu {:>7} calls".format(
+                  totals["stage"], totals["wall_seconds"], totals["cpu_seconds"], totals["child_cpu_seconds"], totals["calls"]))
+        if slowest_documents:
+            print("slowest documents:")
+        for event in slowest_documents:
+            # documents evaluated by resident jvms only have their wall time
+            cpu_seconds = event.get("cpu_seconds", 0.0) + event.get("child_cpu_seconds", 0.0) if "cpu_seconds" in event else None
+            print("   {:<16} {:>9.3f}s wall {:>10} cpu  {}".format(
+                  event["stage"], event["wall_seconds"], "-" if cpu_seconds is None else "{:.3f}s".format(cpu_seconds), event["document"]))
+
+    def close(self):
+        self.trace_file.close()
+# end
+
+class NullProfiler(object):
+    # stands in when --profile is off, every hook returns straight away
+
+    enabled = False
+
+    def record(self, stage, document, measures):
+        pass
+
+    def stage(self, stage, document=None):
+        return NULL_CONTEXT
+
+    def iterate(self, stage, iterable, per_document=False):
+        return iterable
+
+    def summary(self, top=10):
+        pass
+
+    def close(self):
+        pass
+# end
+
+NULL_CONTEXT = nullcontext()
+NULL_PROFILER = NullProfiler()
+
+class FunctionProfiler(object):
+    # cProfile switched on only while one of the instrumented functions runs, nested calls included once
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.depth = 0
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            self.depth += 1
+            if self.depth == 1:
+                self.profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.profile.disable()
+        return profiled
+
+    def instrument(self, module, names):
+        # replaces the module attributes, so calls between the module's own functions are seen too
+        for name in names:
+            setattr(module, name, self.wrap(getattr(module, name)))
+
+    def dump(self, stats_path, top=20):
+        self.profile.dump_stats(stats_path)
+        pstats.Stats(self.profile).sort_stats("cumulative").print_stats(top)
+# end
@@ -0,0 +1,78 @@
+import pandas as pd
+import ocr_stats
+
+class ReportAggregator(object):
+    # folds each document's tables into running counters as soon as they are available, so
+    # memory depends on the number of distinct characters and confusion pairs, not documents
+
+    def __init__(self):
+        self.confusions = {} # (ground truth, ocr output) -> [total_combo, total_occurances]
+        self.char_counts = {} # (character, hex code) -> [substitutions, deletions, insertions, total]
+        self.err_rate_per_doc = {}
+        self.chars_per_doc = {} # ground truth characters per document, weights the document's cer by
+
+    def add(self, filename, master_df_grnd_to_ocr, err_rate_per_char_df):
+        for grnd_truth, ocr_output, total_combo, total_occurances in zip(master_df_grnd_to_ocr["Ground_Truth"].tolist(),
+                                                                         master_df_grnd_to_ocr["OCR_Output"].tolist(),
+                                                                         master_df_grnd_to_ocr["total_combo"].tolist(),
+                                                                         master_df_grnd_to_ocr["total_occurances"].tolist()):
+            counts = self.confusions.setdefault((grnd_truth, ocr_output), [0.0, 0.0])
+            counts[0] += total_combo
+            counts[1] += total_occurances
+
+        # missing counts are skipped by pandas sums, treat them as 0 here as well
+        substitutions = err_rate_per_char_df["Substitutions"].fillna(0).tolist()
+        deletions = err_rate_per_char_df["Deletions"].fillna(0).tolist()
+        insertions = err_rate_per_char_df["Insertions"].fillna(0).tolist()
+        totals = err_rate_per_char_df["Total"].fillna(0).tolist()
+        for i, key in enumerate(zip(err_rate_per_char_df["Character"].tolist(), err_rate_per_char_df["HexCode"].tolist())):
+            if pd.isnull(key[0]) or pd.isnull(key[1]):
+                # groupby drops rows with missing keys
+                continue
+            counts = self.char_counts.setdefault(key, [0.0, 0.0, 0.0, 0.0])
+            counts[0] += substitutions[i]
+            counts[1] += deletions[i]
+            counts[2] += insertions[i]
+            counts[3] += totals[i]
+
+        errors = sum(substitutions) + sum(insertions) + sum(deletions)
+        total = sum(totals)
+        if total == 0:
+            # no ground truth characters, e.g. an empty truth file: nan or inf as the pandas sums gave
+            self.err_rate_per_doc[filename] = float("nan") if errors == 0 else float("inf")
+        else:
+            self.err_rate_per_doc[filename] = errors/total
+        self.chars_per_doc[filename] = total
+
+    def grnd_to_ocr_df(self):
+        keys = sorted(self.confusions)
+        grnd_to_ocr_df_agg = pd.DataFrame({"Ground_Truth": [k[0] for k in keys],
+                                           "OCR_Output": [k[1] for k in keys],
+                                           "total_combo": [self.confusions[k][0] for k in keys],
+                                           "total_occurances": [self.confusions[k][1] for k in keys]},
+                                          columns=["Ground_Truth", "OCR_Output", "total_combo", "total_occurances"])
+        grnd_to_ocr_df_agg = grnd_to_ocr_df_agg[grnd_to_ocr_df_agg.total_occurances != 0].copy()
+        grnd_to_ocr_df_agg["Total_Combo_by_total_occurances"] = grnd_to_ocr_df_agg["total_combo"] / grnd_to_ocr_df_agg["total_occurances"]
+        return grnd_to_ocr_df_agg
+
+    def err_rate_per_char_df(self):
+        keys = sorted(self.char_counts)
+        err_rate_per_char_df_agg = pd.DataFrame({"Character": [k[0] for k in keys],
+                                                 "HexCode": [k[1] for k in keys],
+                                                 "Substitutions": [self.char_counts[k][0] for k in keys],
+                                                 "Deletions": [self.char_counts[k][1] for k in keys],
+                                                 "Insertions": [self.char_counts[k][2] for k in keys],
+                                                 "Total": [self.char_counts[k][3] for k in keys]},
+                                                columns=["Character", "HexCode", "Substitutions", "Deletions", "Insertions", "Total"])
+        err_rate_per_char_df_agg = err_rate_per_char_df_agg[err_rate_per_char_df_agg.Total != 0].copy()
+        err_rate_per_char_df_agg["Error_Rate"] = ocr_stats.error_rates(err_rate_per_char_df_agg[["Substitutions", "Insertions", "Deletions"]].values.sum(axis=1),
+                                                                       err_rate_per_char_df_agg["Total"].values)
+        return err_rate_per_char_df_agg
+
+    def err_rate_per_doc_df(self):
+        filenames = sorted(self.err_rate_per_doc)
+        return pd.DataFrame({"filename": filenames,
+                             "CER": [self.err_rate_per_doc[filename] for filename in filenames],
+                             "Characters": [self.chars_per_doc[filename] for filename in filenames]},
+                            columns=["filename", "CER", "Characters"])
+# end
@@ -11,8 +11,14 @@ import traceback
 from bs4 import BeautifulSoup
 from bs4.element import Comment
 from collections import Counter
+from itertools import islice
+import ocr_report_parser as report_parser
+import ocr_stats
+from ocr_report_aggregator import ReportAggregator
+from ocr_profiler import NULL_PROFILER
 
 verbose = False
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
 
 def readData(file_path, html=True):
     with io.open(file_path, encoding="utf-8") as file:
@@ -28,7 +34,8 @@ def writeData(file_path, data, html=True):
         file.write(data)
 # end
 
-def format_agg_report_html(tableData, cer, iframe_graphs, stats):
+def format_agg_report_html(cer, iframe_graphs, stats, quarantined=()):
+    # everything in the aggregated report up to the tables, which are streamed after it
     # define html elements
     iframe_cer_by_doc, iframe_box_plot = iframe_graphs
     html_open_tag = "<html>"
@@ -38,31 +45,90 @@ def format_agg_report_html(tableData, cer, iframe_graphs, stats):
     mean_html = "<h4> Mean Character Error Rate (across all documents): {} </h4>".format(stats["pop_mean"])
     msd_html = "<h4> Variance of Aggregated Character Error Rate Distribution: {} </h4>".format(stats["pop_msd"])
     std_html = "<h4> Standard Deviation of Aggregated Character Error Rate Distribution: {} </h4>".format(stats["pop_std"])
-    html_close_body_tag = "</body>"
-    html_close_tag = "</html>"
+    # spread and uncertainty of the per document rates, intervals are bootstrapped over documents
+    confidence = "{:.0f}%".format(100*stats["confidence"])
+    quantiles_html = "<h4> Median, Quartiles and Interquartile Range of Character Error Rates: {} (Q1 {}, Q3 {}, IQR {}, min {}, max {}) </h4>".format(stats["median"], stats["q1"], stats["q3"], stats["iqr"], stats["min"], stats["max"])
+    ci_html = "<h4> {} Bootstrap Confidence Interval of the Mean Character Error Rate: [{}, {}], of the Median: [{}, {}] ({} resamples) </h4>".format(confidence, stats["mean_ci"][0], stats["mean_ci"][1], stats["median_ci"][0], stats["median_ci"][1], stats["num_resamples"])
+    if "weighted_mean" in stats:
+        ci_html += "<h4> {} Bootstrap Confidence Interval of the Aggregated Character Error Rate (documents weighted by characters): [{}, {}], weighted standard deviation {} </h4>".format(confidence, stats["weighted_mean_ci"][0], stats["weighted_mean_ci"][1], stats["weighted_std"])
+    outliers_html = "<h4> Outlying Documents: {} beyond 1 standard deviation, {} beyond 2 standard deviations, {} beyond 1.5 IQR of the quartiles (of {}) </h4>".format(stats["outliers_1std"], stats["outliers_2std"], stats["outliers_iqr"], stats["num_docs"])
+    if stats.get("num_undefined"):
+        outliers_html += "<h4> Documents without Ground Truth Characters: {}, left out of the statistics above </h4>".format(stats["num_undefined"])
     cer_explaination = "<h3> What is Character/Word Error Rate? </h3><p>The general difficulty of measuring performance lies in the fact that the recognized character sequence can have a different length from the reference character sequence (supposedly the correct one). The WER/CER is derived from the Levenshtein distance, CER working at the character level and WER working at the word level. The WER/CER is a valuable tool for comparing different systems as well as for evaluating improvements within one system. This kind of measurement, however, provides no details on the nature of translation errors and further work is therefore required to identify the main source(s) of error and to focus any research effort.</p>"
     cer_formula = "<img src='https://wikimedia.org/api/rest_v1/media/math/render/svg/7db6226f0c365982b94f221d68530bf8a6a50611' class='mwe-math-fallback-image-inline' aria-hidden='true' style='vertical-align: -2.171ex; width:34.607ex; height:5.676ex;' alt='{\displaystyle {\mathit {WER}}={\frac {S+D+I}{N}}={\frac {S+D+I}{S+D+C}}}'> <p>where</p> <ul><li><i>S</i> is the number of substitutions,</li><li><i>D</i> is the number of deletions,</li><li><i>I</i> is the number of insertions,</li><li><i>C</i> is the number of the corrects,</li><li><i>N</i> is the number of words in the reference (N=S+D+C)</li></ul>"
+    # pairs the evaluation gave up on are named rather than silently missing from the numbers
+    quarantine_html = ""
+    if quarantined:
+        quarantine_rows = "".join("<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(os.path.basename(job.paths[1]), os.path.basename(job.paths[0]), job.attempts, job.error) for job in quarantined)
+        quarantine_html = "<h2> Quarantined Documents </h2> <p>{} documents could not be evaluated and are left out of every metric, graph and table in this report</p> <table border='1'><tr><td>Test File</td><td>Ground Truth File</td><td>Attempts</td><td>Reason</td></tr>{}</table>".format(len(quarantined), quarantine_rows)
     # bind html elements
-    body_html = "{} <h2> Metrics </h2> {} {} {} {} {} {} <h2> Graphs </h2> <div> {} </div> <div> {} </div> <div> {} </div> <h2> Tables </h2> <center>{}</center>".format(html_open_body_tag, cer_explaination, cer_formula, cer_html, mean_html, msd_html, std_html, iframe_cer_by_doc, iframe_box_plot, tableData, html_close_body_tag)
-    html_report_agg = "{} {} {} {}".format(html_open_tag, html_header, body_html, html_close_tag)
+    body_html = "{} <h2> Metrics </h2> {} {} {} {} {} {} {} {} {} <h2> Graphs </h2> <div> {} </div> <div> {} </div> {} <h2> Tables </h2> <center>".format(html_open_body_tag, cer_explaination, cer_formula, cer_html, mean_html, msd_html, std_html, quantiles_html, ci_html, outliers_html, iframe_cer_by_doc, iframe_box_plot, quarantine_html)
+    html_report_agg = "{} {} {}".format(html_open_tag, html_header, body_html)
     return html_report_agg
 # end
 
+def write_agg_report_html(file_path, tables, cer, iframe_graphs, stats, max_rows_per_page=None, quarantined=()):
+    # tables: (title, dataframe) pairs, rows are written straight to the file in chunks. Tables longer
+    # than max_rows_per_page keep their first page inline and link to sub-pages next to the report
+    with io.open(file_path, "w", encoding="utf-8") as file:
+        file.write(format_agg_report_html(cer, iframe_graphs, stats, quarantined))
+        write_tables(file, file_path, tables, max_rows_per_page)
+        file.write(" </center> </body> </html>")
+# end
+
+def write_tables(file, file_path, tables, max_rows_per_page=None):
+    for table_num, (title, data) in enumerate(tables):
+        if table_num > 0:
+            file.write("<br><br>")
+        if max_rows_per_page is None or len(data) <= max_rows_per_page:
+            writeTable(file, data, title, data.columns)
+            continue
+        page_paths = write_table_pages(file_path, table_num, data, title, max_rows_per_page)
+        writeTable(file, data.iloc[:max_rows_per_page], "{} (page 1 of {})".format(title, len(page_paths) + 1), data.columns)
+        file.write(format_page_links(page_paths, 0))
+# end
+
+def write_table_pages(file_path, table_num, data, title, max_rows_per_page):
+    num_pages = int(math.ceil(len(data) / float(max_rows_per_page)))
+    page_paths = ["{}_table{}_page{}.html".format(os.path.splitext(file_path)[0], table_num + 1, page + 1) for page in range(1, num_pages)]
+    for page, page_path in enumerate(page_paths, start=1):
+        with io.open(page_path, "w", encoding="utf-8") as file:
+            file.write("<html> <head><meta http-equiv='Content-Type' content='text/html; charset=UTF-8'></head> <body> <p><a href='{}'>back to report</a></p> <center>".format(os.path.basename(file_path)))
+            writeTable(file, data.iloc[page*max_rows_per_page:(page + 1)*max_rows_per_page], "{} (page {} of {})".format(title, page + 1, num_pages), data.columns)
+            file.write(format_page_links(page_paths, page))
+            file.write(" </center> </body> </html>")
+    return page_paths
+# end
+
+def format_page_links(page_paths, current_page):
+    links = ["<a href='{}'>{}</a>".format(os.path.basename(page_path), page + 2) for page, page_path in enumerate(page_paths)]
+    return "<p>more rows on pages: {}</p>".format(" ".join(links)) if current_page == 0 else "<p>pages: {}</p>".format(" ".join(links))
+# end
+
+def formatRows(data, num_cols):
+    # one string per row from the column values, no per row Series like iterrows
+    row_format = "<tr>" + "<td>{}</td>"*num_cols + "</tr>"
+    for row in data.itertuples(index=False, name=None):
+        yield row_format.format(*row)
+# end
+
+def writeTable(file, data, title, col_names, chunk_rows=5000):
+    file.write("<table border='1'><caption><h2>{}</caption></h2><tr>{}</tr>".format(title, "".join("<td>{}</td>".format(col_name) for col_name in col_names)))
+    rows = formatRows(data, len(col_names))
+    for chunk in iter(lambda: list(islice(rows, chunk_rows)), []):
+        file.write("".join(chunk))
+    file.write("</table>")
+# end
+
 def formatData(data, title, col_names, typeOfData):
-    formattedData = "<table border='1'><caption><h2>{}</caption></h2><tr>".format(title)
-    for col_name in col_names:
-        formattedData += "<td>{}</td>".format(col_name)
-    formattedData +="</tr>"
+    formattedData = ["<table border='1'><caption><h2>{}</caption></h2><tr>".format(title)]
+    formattedData.extend("<td>{}</td>".format(col_name) for col_name in col_names)
+    formattedData.append("</tr>")
     if typeOfData==0:
-        for k, v in data.items():
-            formattedData += "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(k[0], k[1], v[0], v[1], v[2])
+        formattedData.extend("<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(k[0], k[1], v[0], v[1], v[2]) for k, v in data.items())
     else:
-        for index, row in data.iterrows():
-            formattedData += "<tr>"
-            for elm in row:
-                formattedData += "<td>{}</td>".format(elm)
-            formattedData += "</tr>"
-    return formattedData
+        formattedData.extend(formatRows(data, len(col_names)))
+    return "".join(formattedData)
 # end
 
 def tag_visible(element):
@@ -139,7 +205,7 @@ def format_for_dataframe(typeOfGuess_total):
     return master_df_grnd_to_ocr_df
 # end
 
-def add_report_table(html_report_file_path):
+def extract_report_data(html_report_file_path):
 
     report_soup = readData(html_report_file_path) # read all html in file
     tables = report_soup.find('body').find_all('table', recursive=False) # all tables in html file as a list
@@ -150,69 +216,109 @@ def add_report_table(html_report_file_path):
     table_data_test = cmp_table_wout_header.find_all('td')[1] # table data test text
 
     # extract all text found in both truth and test tables 
-    confusedSpots_grnd_true = [x.find('font').contents[0] for x in table_data_grnd_true.find_all('span')]
-    confusedSpots_test = [x.find('font').contents[0] for x in table_data_test.find_all('span')]
+    # plain str copies, NavigableStrings would keep the whole parse tree alive (and pickled) with the dataframes
+    confusedSpots_grnd_true = [str(x.find('font').contents[0]) for x in table_data_grnd_true.find_all('span')]
+    confusedSpots_test = [str(x.find('font').contents[0]) for x in table_data_test.find_all('span')]
 
-    # zip grnd truth and test diffs
-    confusedSpots_zipped=Counter([i for i in list(zip(confusedSpots_grnd_true, confusedSpots_test))])
     confusedSpots_grnd_true_str_html = str(table_data_grnd_true)
     confusedSpots_grnd_true_str_text = text_from_html(confusedSpots_grnd_true_str_html)
 
-    total_elms_count = get_num_instances_confusedSpots(confusedSpots_grnd_true_str_text, confusedSpots_grnd_true)
-    confused_elms_count = Counter(confusedSpots_grnd_true)
+    bs = BeautifulSoup(str(tables[1]), "html.parser")
+    tds = [row.findAll('td') for row in bs.findAll('tr')]
+    row_data = [tuple(None if cell.string is None else str(cell.string) for cell in td[:7]) for td in tds]
+    return confusedSpots_grnd_true, confusedSpots_test, confusedSpots_grnd_true_str_text, row_data
+# end
+
+def count_confusedSpots(diff_spot_table_data, confusedSpots):
+    # same counts as get_num_instances_confusedSpots, one lookup per distinct span: a character
+    # histogram for single characters, str.count for other literal spans, the original regex
+    # handling only for spans containing regex metacharacters
+    histogram = Counter(diff_spot_table_data)
+    total_elms_count = {}
+    regex_spots = []
+    for elm in set(confusedSpots):
+        if any(c in REGEX_METACHARACTERS for c in elm):
+            regex_spots.append(elm)
+        elif len(elm) == 1:
+            total_elms_count[elm] = histogram[elm]
+        else:
+            total_elms_count[elm] = diff_spot_table_data.count(elm)
+    total_elms_count.update(get_num_instances_confusedSpots(diff_spot_table_data, regex_spots))
+    return total_elms_count
+# end
+
+def format_failure_table(typeOfGuess_total):
+    # the table appended to each per document report, by add_report_table and the native engine alike
+    return formatData(data=typeOfGuess_total, title="Instances of OCR Failure: Ground Truth vs OCR Output", col_names=["Ground_Truth", "OCR_Output", "total_combo", "total_occurances", "guess_to_total"], typeOfData=0)
+# end
+
+def add_report_table(html_report_file_path, streaming=True):
+
+    if streaming:
+        report_data = report_parser.extract_report_data(html_report_file_path)
+        count_spots = count_confusedSpots
+    else:
+        report_data = extract_report_data(html_report_file_path)
+        count_spots = get_num_instances_confusedSpots
+    confusedSpots_grnd_true, confusedSpots_test, confusedSpots_grnd_true_str_text, row_data = report_data
+
+    # zip grnd truth and test diffs
+    confusedSpots_zipped=Counter([i for i in list(zip(confusedSpots_grnd_true, confusedSpots_test))])
+
+    total_elms_count = count_spots(confusedSpots_grnd_true_str_text, confusedSpots_grnd_true)
     typeOfGuess_total = build_analytics_for_report(confusedSpots_zipped, total_elms_count)
 
-    reportTableInfo=formatData(data=typeOfGuess_total, title="Instances of OCR Failure: Ground Truth vs OCR Output", col_names=["Ground_Truth", "OCR_Output", "total_combo", "total_occurances", "guess_to_total"], typeOfData=0)
-    writeData(file_path=os.path.join(os.getcwd(), html_report_file_path), data=reportTableInfo)
+    writeData(file_path=os.path.join(os.getcwd(), html_report_file_path), data=format_failure_table(typeOfGuess_total))
     master_df_grnd_to_ocr = format_for_dataframe_grnd_to_ocr(typeOfGuess_total)
 
-    bs = BeautifulSoup(str(tables[1]), "html.parser")
-    tds = [row.findAll('td') for row in bs.findAll('tr')]
-    row_data = [(td[0].string,
-                td[1].string,
-                td[2].string,
-                td[3].string,
-                td[4].string,
-                td[5].string,
-                td[6].string,) for td in tds]
     rows_df = format_for_dataframe(typeOfGuess_total=row_data[1:])
     return master_df_grnd_to_ocr, rows_df 
 # end
 
-def calculate_stats(x):
-    stats = {}
-    stats["pop_mean"]=sum(x)/len(x) 
-    diff_srq = lambda x: (x-stats["pop_mean"])**2
-    stats["pop_msd"] = (1/len(x))*(sum(list(map(diff_srq, x)))) # variance using mean square difference
-    stats["pop_std"] = math.sqrt(stats["pop_msd"])
-    return stats
+def calculate_stats(x, weights=None, num_resamples=ocr_stats.BOOTSTRAP_RESAMPLES):
+    # x: cer per document, weights: characters per document
+    return ocr_stats.corpus_stats(x, weights, num_resamples)
+# end
+
+def collect_report_tables(output_dir_content):
+    for outputfile in output_dir_content:
+        # add report table to output file
+        master_df_grnd_to_ocr, err_rate_per_char_df = add_report_table(outputfile)
+        yield outputfile.split("/")[-1], master_df_grnd_to_ocr, err_rate_per_char_df
 # end
 
-def create_reports(output_dir_content, full_path_output_dir, tool, plotly_uname, plotly_api_key):
-   grnd_to_ocr = []
-   err_rate_per_char = []
-   err_rate_per_doc = {}
-   for outputfile in output_dir_content:
-       # add report table to output file
-       master_df_grnd_to_ocr, err_rate_per_char_df = add_report_table(outputfile)
-       err_rate_per_doc[outputfile.split("/")[-1]] = (err_rate_per_char_df["Substitutions"].sum()
-                                                     + err_rate_per_char_df["Insertions"].sum()
-                                                     + err_rate_per_char_df["Deletions"].sum())/err_rate_per_char_df["Total"].sum()
-                                                                              
-       # bundle stats from report added to html in dataframe in list
-       grnd_to_ocr.append(master_df_grnd_to_ocr)
-       err_rate_per_char.append(err_rate_per_char_df)
+def create_reports(output_dir_content, full_path_output_dir, tool, plotly_uname, plotly_api_key, report_tables=None, max_rows_per_page=None, profiler=NULL_PROFILER, quarantined=(), num_resamples=ocr_stats.BOOTSTRAP_RESAMPLES, aggregator=None, store_writer=None):
+   # report_tables: (filename, grnd_to_ocr_df, err_rate_per_char_df) per document, parsed from the html reports when not given
+   # aggregator: anything with ReportAggregator's tables, e.g. a view of a results store, skips parsing altogether
+   # store_writer: also records every document in a results store, saved once all are in
+   if aggregator is None:
+       if report_tables is None:
+           report_tables = profiler.iterate("parse", collect_report_tables(output_dir_content), per_document=True)
+       # fold each document into the running totals as soon as it is available
+       aggregator = ReportAggregator()
+       for filename, master_df_grnd_to_ocr, err_rate_per_char_df in report_tables:
+           with profiler.stage("aggregate"):
+               aggregator.add(filename, master_df_grnd_to_ocr, err_rate_per_char_df)
+           if store_writer is not None:
+               with profiler.stage("store"):
+                   store_writer.add(filename, master_df_grnd_to_ocr, err_rate_per_char_df)
+       if store_writer is not None:
+           with profiler.stage("store"):
+               store_writer.save()
 
    currenttime = datetime.now().strftime("%Y%m%d%H%M%S")
 
-   err_rate_per_doc_df = pd.DataFrame(list(err_rate_per_doc.items()),
-                                      columns=["filename", "CER"])
+   with profiler.stage("aggregate"):
+       err_rate_per_doc_df = aggregator.err_rate_per_doc_df()
 
    # register plotly credentials to put plot on remote server 
-   tls.set_credentials_file(plotly_uname, plotly_api_key)
+   with profiler.stage("plotly"):
+       tls.set_credentials_file(plotly_uname, plotly_api_key)
 
    # calculate basic stats on CER 
-   stats = calculate_stats(err_rate_per_doc_df["CER"].tolist())
+   with profiler.stage("stats"):
+       y = ocr_stats.as_array(err_rate_per_doc_df["CER"].values)
+       stats = calculate_stats(y, err_rate_per_doc_df["Characters"].values, num_resamples)
 
    # cer by document plotly RAW BAR GRAPH OF VALUES
    data = [go.Bar(
@@ -224,17 +330,20 @@ def create_reports(output_dir_content, full_path_output_dir, tool, plotly_uname,
                       xaxis=dict(title="Documents"),
                       yaxis=dict(title="Character Error Rate"),
                      )
-   fig = go.Figure(data=data, layout=layout)
-   httpplot = py.plot(fig, filename="Basic_Bar_CER_AcrossDocs_{}_{}".format(tool, currenttime))
-   iframe_cer_by_doc = tls.get_embed(httpplot)
+   with profiler.stage("plotly"):
+       fig = go.Figure(data=data, layout=layout)
+       httpplot = py.plot(fig, filename="Basic_Bar_CER_AcrossDocs_{}_{}".format(tool, currenttime))
+       iframe_cer_by_doc = tls.get_embed(httpplot)
 
    # PROBABILITY DENSITY FUNCTIONS
-   y_outliers_removed_2std = list(filter(lambda x: x<(stats["pop_mean"]+2*stats["pop_std"]) and x>(stats["pop_mean"]-2*stats["pop_std"]), list(map(float, err_rate_per_doc_df["CER"].tolist()))))
-   y_outliers_removed_1std = list(filter(lambda x: x<(stats["pop_mean"]+1*stats["pop_std"]) and x>(stats["pop_mean"]-1*stats["pop_std"]), list(map(float, err_rate_per_doc_df["CER"].tolist()))))
-   y = list(map(float, err_rate_per_doc_df["CER"].tolist()))
-   hist_data = [y, y_outliers_removed_1std, y_outliers_removed_2std]
-   group_labels = ["CERs_actual", "CERs_outliers_removed_1std", "CERs_outliers_removed_2std"]
-   colors = ["#333F44", "#008080", "#FF33FF"]
+   with profiler.stage("stats"):
+       y_outliers_removed_2std = y[ocr_stats.sigma_mask(y, 2)].tolist()
+       y_outliers_removed_1std = y[ocr_stats.sigma_mask(y, 1)].tolist()
+       y_outliers_removed_iqr = y[ocr_stats.iqr_mask(y)].tolist()
+       y = y.tolist()
+   hist_data = [y, y_outliers_removed_1std, y_outliers_removed_2std, y_outliers_removed_iqr]
+   group_labels = ["CERs_actual", "CERs_outliers_removed_1std", "CERs_outliers_removed_2std", "CERs_outliers_removed_iqr"]
+   colors = ["#333F44", "#008080", "#FF33FF", "#FF8C00"]
    #fig = ff.create_distplot(hist_data, group_labels, show_hist=False, colors=colors)
    #fig["layout"].update(title="Comparison of CER Probability Density Functions", xaxis=dict(title="Character Error Rate"))
    #httpplot = py.plot(fig, filename="Curve and Rug_{}".format(tool))
@@ -262,54 +371,37 @@ def create_reports(output_dir_content, full_path_output_dir, tool, plotly_uname,
            marker= dict(color="#FF33FF",),
            boxmean=True
            )
+   trace3 = go.Box(
+           y = y_outliers_removed_iqr,
+           boxpoints="all",
+           name="CERs_outliers_removed_iqr",
+           marker= dict(color="#FF8C00",),
+           boxmean=True
+           )
 
-   data=[trace0, trace1, trace2]
+   data=[trace0, trace1, trace2, trace3]
    layout = go.Layout(
                       title="Box Plot: CER Distribution Comparision",
                       yaxis=dict(title="Character Error Rates"),
                      )
 
-   fig = go.Figure(data=data, layout=layout)
-   httpplot = py.plot(fig, filename="Box_Plot_CER_Distribution_Comparision_{}_{}".format(tool, currenttime))
-   iframe_box_plot = tls.get_embed(httpplot)
-
-   # vertically stack dataframes from bundled list above
-   grnd_to_ocr_df_agg = pd.concat(grnd_to_ocr[:],axis=0)
-   err_rate_per_char_df_agg = pd.concat(err_rate_per_char[:],axis=0)
-
-   # combine rows that pertain to same values in vertically stacked dataframes
-   grnd_to_ocr_df_agg = grnd_to_ocr_df_agg.groupby(["Ground_Truth","OCR_Output", "ground_truth-ocr_output"], as_index=False)["total_combo", "total_occurances"].sum()
-   err_rate_per_char_df_agg = err_rate_per_char_df_agg.groupby(["Character","HexCode"], as_index=False)["Substitutions","Deletions","Insertions","Total"].sum() 
-
-   # drop unnecessary columns in aggregated dataframes
-   err_rate_per_char_df_agg = err_rate_per_char_df_agg.drop(err_rate_per_char_df_agg[err_rate_per_char_df_agg.Total==0].index)
-   grnd_to_ocr_df_agg = grnd_to_ocr_df_agg.drop(grnd_to_ocr_df_agg[grnd_to_ocr_df_agg.total_occurances==0].index)
-   grnd_to_ocr_df_agg = grnd_to_ocr_df_agg.drop("ground_truth-ocr_output",axis=1)
-
-   # perform character rate calculation
-   err_rate_per_char_df_agg["Error_Rate"] = err_rate_per_char_df_agg.apply(lambda row: (sum([row["Substitutions"],
-                                                                                             row["Insertions"],
-                                                                                             row["Deletions"]])
-                                                                                       /row["Total"]) 
-                                                                                       if row["Total"] > 0
-                                                                                       else "Infinity",
-                                                                                       axis=1)
-
-   grnd_to_ocr_df_agg["Total_Combo_by_total_occurances"] = grnd_to_ocr_df_agg.apply(lambda row: row["total_combo"] / row["total_occurances"] if row["total_occurances"] > 0 else "Undefined", axis=1)
-
-   agg_char_err_rate = sum([err_rate_per_char_df_agg["Substitutions"].sum(),
-                        err_rate_per_char_df_agg["Insertions"].sum(),
-                        err_rate_per_char_df_agg["Deletions"].sum()]) / err_rate_per_char_df_agg["Total"].sum() 
+   with profiler.stage("plotly"):
+       fig = go.Figure(data=data, layout=layout)
+       httpplot = py.plot(fig, filename="Box_Plot_CER_Distribution_Comparision_{}_{}".format(tool, currenttime))
+       iframe_box_plot = tls.get_embed(httpplot)
+
+   # aggregated tables with error rates computed column-wise
+   with profiler.stage("aggregate"):
+       grnd_to_ocr_df_agg = aggregator.grnd_to_ocr_df()
+       err_rate_per_char_df_agg = aggregator.err_rate_per_char_df()
+
+   agg_char_err_rate = ocr_stats.aggregated_rate(err_rate_per_char_df_agg[["Substitutions", "Insertions", "Deletions"]].values,
+                                                 err_rate_per_char_df_agg["Total"].values)
    #err_rate_per_char_df_agg.to_csv("after_err_rate_per_char_df_agg.csv", sep=",")
-   grnd_to_ocr_html_table = formatData(data=grnd_to_ocr_df_agg,
-                                       title="Instances of OCR Failure: Ground Truth vs OCR Output",
-                                       col_names=grnd_to_ocr_df_agg.columns,
-                                       typeOfData=1)
-   err_rate_per_char_html_table = formatData(data=err_rate_per_char_df_agg,
-                                             title="Error Rate Per Character",
-                                             col_names=err_rate_per_char_df_agg.columns,
-                                             typeOfData=1)
-   #html_report_agg = format_agg_report_html(tableData=err_rate_per_char_html_table+"<br>"+"<br>"+grnd_to_ocr_html_table, cer=agg_char_err_rate, iframe_graphs=[iframe_cer_by_doc, iframe_cer_dist, iframe_box_plot], stats=stats)
-   html_report_agg = format_agg_report_html(tableData=err_rate_per_char_html_table+"<br>"+"<br>"+grnd_to_ocr_html_table, cer=agg_char_err_rate, iframe_graphs=[iframe_cer_by_doc, iframe_box_plot], stats=stats)
-   writeData(file_path=os.path.join(full_path_output_dir, "{}_aggregated_report.html".format(tool)), data=html_report_agg)
+   with profiler.stage("write_html"):
+       write_agg_report_html(file_path=os.path.join(full_path_output_dir, "{}_aggregated_report.html".format(tool)),
+                             tables=[("Error Rate Per Character", err_rate_per_char_df_agg),
+                                     ("Instances of OCR Failure: Ground Truth vs OCR Output", grnd_to_ocr_df_agg)],
+                             cer=agg_char_err_rate, iframe_graphs=[iframe_cer_by_doc, iframe_box_plot], stats=stats,
+                             max_rows_per_page=max_rows_per_page, quarantined=quarantined)
 # end
@@ -0,0 +1,174 @@
+import io
+import sys
+import time
+from html.parser import HTMLParser
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+INVISIBLE_PARENTS = {"style", "script", "head", "title", "meta"}
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+class ReportStreamParser(HTMLParser):
+    # single pass state machine over an ocrevalUAtion report, keeps only what add_report_table
+    # needs: the confused spans of both columns, the visible ground truth text and the rows of
+    # the per character table, never the document tree
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.stack = []
+        self.pending = []
+        self.num_tables = 0
+        self.table_depth = None # stack depth of the open top level table
+        self.num_cmp_rows = 0
+        self.cmp_row_depth = None
+        self.num_cmp_cells = 0
+        self.cmp_cell_index = None
+        self.cmp_cell_depth = None
+        self.span_depth = None
+        self.span_has_font = False
+        self.font_depth = None
+        self.font_has_child = False
+        self.cell_depth = None
+        self.cell_child_counts = None
+        self.cell_text = None
+        self.confusedSpots = ([], [])
+        self.grnd_true_texts = []
+        self.rows = []
+
+    def flush_text(self):
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        if "pre" not in self.stack and "textarea" not in self.stack and all(c in ASCII_SPACES for c in text):
+            # bs4 collapses whitespace only strings the same way
+            text = "\n" if "\n" in text else " "
+        self.add_child(text)
+        if self.cmp_cell_index == 0 and (not self.stack or self.stack[-1] not in INVISIBLE_PARENTS):
+            self.grnd_true_texts.append(text.strip())
+
+    def add_child(self, text):
+        # text is None for an element child
+        if self.font_depth is not None and not self.font_has_child:
+            self.font_has_child = True
+            if text is not None:
+                self.confusedSpots[self.cmp_cell_index].append(text)
+        if self.cell_child_counts is not None:
+            self.cell_child_counts[-1] += 1
+            if text is not None:
+                self.cell_text = text
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_text()
+        self.add_child(None)
+        if tag in VOID_TAGS:
+            return
+        self.stack.append(tag)
+        depth = len(self.stack)
+        if tag == "table" and self.table_depth is None and depth >= 2 and self.stack[-2] == "body":
+            self.table_depth = depth
+            self.num_tables += 1
+        elif self.table_depth is None:
+            pass
+        elif self.num_tables == 1:
+            if tag == "tr":
+                self.num_cmp_rows += 1
+                if self.num_cmp_rows == 2:
+                    self.cmp_row_depth = depth
+            elif tag == "td" and self.cmp_row_depth is not None and self.cmp_cell_index is None:
+                self.num_cmp_cells += 1
+                if self.num_cmp_cells <= 2:
+                    self.cmp_cell_index = self.num_cmp_cells - 1
+                    self.cmp_cell_depth = depth
+            elif tag == "span" and self.cmp_cell_index is not None and self.span_depth is None:
+                self.span_depth = depth
+                self.span_has_font = False
+            elif tag == "font" and self.span_depth is not None and not self.span_has_font:
+                self.span_has_font = True
+                self.font_depth = depth
+                self.font_has_child = False
+        elif self.num_tables == 2:
+            if tag == "tr":
+                self.rows.append([])
+            elif tag == "td" and self.rows and self.cell_depth is None:
+                self.cell_depth = depth
+                self.cell_child_counts = [0]
+                self.cell_text = None
+                return
+        if self.cell_child_counts is not None:
+            self.cell_child_counts.append(0)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        self.flush_text()
+        while self.stack:
+            depth = len(self.stack)
+            closed = self.stack.pop()
+            self.close_element(depth)
+            if closed == tag:
+                break
+
+    def close_element(self, depth):
+        if depth == self.font_depth:
+            self.font_depth = None
+        elif depth == self.span_depth:
+            self.span_depth = None
+        elif depth == self.cmp_cell_depth:
+            self.cmp_cell_depth = None
+            self.cmp_cell_index = None
+        elif depth == self.cmp_row_depth:
+            self.cmp_row_depth = None
+        elif depth == self.cell_depth:
+            # same rule as bs4's .string, one child all the way down or nothing
+            single = all(count <= 1 for count in self.cell_child_counts)
+            self.rows[-1].append(self.cell_text if single else None)
+            self.cell_depth = None
+            self.cell_child_counts = None
+        elif depth == self.table_depth:
+            self.table_depth = None
+        if self.cell_child_counts is not None and depth > self.cell_depth:
+            self.cell_child_counts.pop()
+
+    def handle_comment(self, data):
+        self.flush_text()
+
+    def handle_decl(self, decl):
+        self.flush_text()
+
+    def handle_pi(self, data):
+        self.flush_text()
+
+    def handle_data(self, data):
+        self.pending.append(data)
+# end
+
+def extract_report_data(html_report_file_path, chunk_size=1 << 16):
+    # same values as ocr_report_generator.extract_report_data, read in chunks
+    parser = ReportStreamParser()
+    with io.open(html_report_file_path, encoding="utf-8") as file:
+        for chunk in iter(lambda: file.read(chunk_size), ""):
+            parser.feed(chunk)
+    parser.close()
+    parser.flush_text()
+    confusedSpots_grnd_true, confusedSpots_test = parser.confusedSpots
+    confusedSpots_grnd_true_str_text = " ".join(parser.grnd_true_texts)
+    row_data = [tuple(row[:7]) for row in parser.rows]
+    return confusedSpots_grnd_true, confusedSpots_test, confusedSpots_grnd_true_str_text, row_data
+# end
+
+if __name__ == "__main__":
+    # benchmark against the BeautifulSoup path: python ocr_report_parser.py report.html [report.html ...]
+    import ocr_report_generator as report_generator
+    timings = {"bs4": 0.0, "stream": 0.0}
+    for html_report_file_path in sys.argv[1:]:
+        start = time.time()
+        expected = report_generator.extract_report_data(html_report_file_path)
+        expected_total_elms_count = report_generator.get_num_instances_confusedSpots(expected[2], expected[0])
+        timings["bs4"] += time.time() - start
+        start = time.time()
+        streamed = extract_report_data(html_report_file_path)
+        streamed_total_elms_count = report_generator.count_confusedSpots(streamed[2], streamed[0])
+        timings["stream"] += time.time() - start
+        if expected != streamed or expected_total_elms_count != streamed_total_elms_count:
+            print("mismatch: {}".format(html_report_file_path))
+    print("{} reports, bs4: {:.3f}s, stream: {:.3f}s".format(len(sys.argv[1:]), timings["bs4"], timings["stream"]))
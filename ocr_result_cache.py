@@ -0,0 +1,69 @@
+import os
+import pickle
+import hashlib
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+# end
+
+class ResultCache(object):
+    # per document evaluation results on disk, keyed by the content of the truth and test
+    # files and the evaluator version; least recently used entries go first when over size
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.num_hits = 0
+        self.num_misses = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def make_key(self, truth_path, test_path, evaluator_version):
+        return hashlib.sha256("{}\n{}\n{}".format(file_digest(truth_path), file_digest(test_path), evaluator_version).encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def get(self, key):
+        # (report html bytes, grnd_to_ocr_df, err_rate_per_char_df) or None
+        path = self.entry_path(key)
+        try:
+            with open(path, "rb") as file:
+                entry = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.num_misses += 1
+            return None
+        os.utime(path, None) # mark as recently used
+        self.num_hits += 1
+        return entry
+
+    def put(self, key, report_html, master_df_grnd_to_ocr, err_rate_per_char_df):
+        path = self.entry_path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as file:
+            pickle.dump((report_html, master_df_grnd_to_ocr, err_rate_per_char_df), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".pkl"):
+                    stat = os.stat(os.path.join(root, file))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file)))
+        total_bytes = sum(entry[1] for entry in entries)
+        num_evicted = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            total_bytes -= size
+            num_evicted += 1
+        return num_evicted
+# end
@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import fnmatch
+import argparse
+import numpy as np
+import pandas as pd
+import ocr_stats
+
+STORE_VERSION = 1
+# counts per character row and per confusion row, in column order
+CHAR_COUNT_COLUMNS = ["Substitutions", "Deletions", "Insertions", "Total"]
+CONFUSION_COUNT_COLUMNS = ["total_combo", "total_occurances"]
+
+def encode_strings(strings):
+    # all strings as one utf-8 buffer plus offsets, no pickled object arrays in the store
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+# end
+
+def decode_strings(buffer, offsets):
+    data = buffer.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+# end
+
+class ResultsStoreWriter(object):
+    # collects each document's report tables as integer coded rows. characters and confusion pairs
+    # are ids into key tables, which point into one string table, so every column is a flat numpy array
+
+    def __init__(self, store_path, tool):
+        self.store_path = store_path
+        self.tool = tool
+        self.strings = {}
+        self.char_keys = {} # (character string id, hex code string id) -> character id
+        self.confusion_keys = {} # (ground truth string id, ocr output string id) -> confusion id
+        self.documents = []
+        self.char_rows = [] # per document (character ids, counts)
+        self.confusion_rows = []
+
+    def string_id(self, string):
+        return self.strings.setdefault(string, len(self.strings))
+
+    def key_id(self, keys, first, second):
+        return keys.setdefault((self.string_id(first), self.string_id(second)), len(keys))
+
+    def add(self, filename, master_df_grnd_to_ocr, err_rate_per_char_df):
+        self.documents.append(self.string_id(filename))
+        # rows without a character still count towards their document's cer, as in ReportAggregator
+        char_ids = [-1 if pd.isnull(character) or pd.isnull(hex_code) else self.key_id(self.char_keys, character, hex_code)
+                    for character, hex_code in zip(err_rate_per_char_df["Character"].tolist(), err_rate_per_char_df["HexCode"].tolist())]
+        char_counts = np.column_stack([err_rate_per_char_df[name].values for name in CHAR_COUNT_COLUMNS]).astype(np.float64)
+        char_counts[np.isnan(char_counts)] = 0
+        self.char_rows.append((np.array(char_ids, dtype=np.int32), char_counts))
+        confusion_ids = [self.key_id(self.confusion_keys, grnd_truth, ocr_output)
+                         for grnd_truth, ocr_output in zip(master_df_grnd_to_ocr["Ground_Truth"].tolist(), master_df_grnd_to_ocr["OCR_Output"].tolist())]
+        self.confusion_rows.append((np.array(confusion_ids, dtype=np.int32),
+                                    np.column_stack([master_df_grnd_to_ocr[name].values for name in CONFUSION_COUNT_COLUMNS]).astype(np.float64)))
+
+    def columns(self, rows, num_counts):
+        doc = np.repeat(np.arange(len(rows), dtype=np.int32), [len(ids) for ids, _ in rows])
+        ids = np.concatenate([ids for ids, _ in rows]) if rows else np.zeros(0, dtype=np.int32)
+        counts = np.concatenate([counts for _, counts in rows]) if rows else np.zeros((0, num_counts))
+        return doc, ids, counts
+
+    def save(self):
+        # written next to the final path and moved there, an interrupted run leaves the last store intact
+        strings = sorted(self.strings, key=self.strings.get)
+        string_buffer, string_offsets = encode_strings(strings)
+        char_doc, char_id, char_counts = self.columns(self.char_rows, len(CHAR_COUNT_COLUMNS))
+        confusion_doc, confusion_id, confusion_counts = self.columns(self.confusion_rows, len(CONFUSION_COUNT_COLUMNS))
+        meta = json.dumps({"version": STORE_VERSION, "tool": self.tool}).encode("utf-8")
+        tmp_path = self.store_path + ".part.npz"
+        np.savez_compressed(tmp_path, meta=np.frombuffer(meta, dtype=np.uint8),
+                            string_buffer=string_buffer, string_offsets=string_offsets,
+                            documents=np.array(self.documents, dtype=np.int32),
+                            char_keys=np.array(sorted(self.char_keys, key=self.char_keys.get), dtype=np.int32).reshape(-1, 2),
+                            confusion_keys=np.array(sorted(self.confusion_keys, key=self.confusion_keys.get), dtype=np.int32).reshape(-1, 2),
+                            char_doc=char_doc, char_id=char_id, char_counts=char_counts,
+                            confusion_doc=confusion_doc, confusion_id=confusion_id, confusion_counts=confusion_counts)
+        os.replace(tmp_path, self.store_path)
+# end
+
+class ResultsStore(object):
+    # a saved store, queried through views over a subset of its documents
+
+    def __init__(self, store_path):
+        with np.load(store_path, allow_pickle=False) as data:
+            columns = dict((name, data[name]) for name in data.files)
+        meta = json.loads(columns["meta"].tobytes().decode("utf-8"))
+        assert(meta["version"] == STORE_VERSION), "{} was written by another version of the results store".format(store_path)
+        self.tool = meta["tool"]
+        self.strings = decode_strings(columns["string_buffer"], columns["string_offsets"])
+        self.documents = [self.strings[i] for i in columns["documents"]]
+        self.char_keys = [(self.strings[first], self.strings[second]) for first, second in columns["char_keys"]]
+        self.confusion_keys = [(self.strings[first], self.strings[second]) for first, second in columns["confusion_keys"]]
+        for name in ("char_doc", "char_id", "char_counts", "confusion_doc", "confusion_id", "confusion_counts"):
+            setattr(self, name, columns[name])
+
+    def select(self, patterns=None, documents=None):
+        # documents whose filename matches any of the glob patterns and/or is listed, all by default
+        mask = np.ones(len(self.documents), dtype=bool)
+        if patterns:
+            mask &= np.array([any(fnmatch.fnmatchcase(document, pattern) for pattern in patterns) for document in self.documents], dtype=bool)
+        if documents is not None:
+            documents = set(documents)
+            mask &= np.array([document in documents for document in self.documents], dtype=bool)
+        return mask
+
+    def view(self, patterns=None, documents=None):
+        return StoreView(self, self.select(patterns, documents))
+# end
+
+class StoreView(object):
+    # the same tables as a ReportAggregator fed with the selected documents, summed with bincount
+
+    def __init__(self, store, doc_mask):
+        self.store = store
+        self.doc_mask = doc_mask
+        self.char_rows = doc_mask[store.char_doc]
+        self.confusion_rows = doc_mask[store.confusion_doc]
+
+    def sum_by(self, ids, counts, num_ids):
+        return np.column_stack([np.bincount(ids, weights=counts[:, column], minlength=num_ids) for column in range(counts.shape[1])])
+
+    def err_rate_per_char_df(self):
+        store = self.store
+        rows = self.char_rows & (store.char_id >= 0)
+        sums = self.sum_by(store.char_id[rows], store.char_counts[rows], len(store.char_keys))
+        present = np.bincount(store.char_id[rows], minlength=len(store.char_keys)) > 0
+        order = sorted(np.flatnonzero(present), key=store.char_keys.__getitem__)
+        err_rate_per_char_df_agg = pd.DataFrame({"Character": [store.char_keys[i][0] for i in order],
+                                                 "HexCode": [store.char_keys[i][1] for i in order]},
+                                                columns=["Character", "HexCode"])
+        for column, name in enumerate(CHAR_COUNT_COLUMNS):
+            err_rate_per_char_df_agg[name] = sums[order, column]
+        err_rate_per_char_df_agg = err_rate_per_char_df_agg[err_rate_per_char_df_agg.Total != 0].copy()
+        err_rate_per_char_df_agg["Error_Rate"] = ocr_stats.error_rates(err_rate_per_char_df_agg[["Substitutions", "Insertions", "Deletions"]].values.sum(axis=1),
+                                                                       err_rate_per_char_df_agg["Total"].values)
+        return err_rate_per_char_df_agg
+
+    def grnd_to_ocr_df(self):
+        store = self.store
+        rows = self.confusion_rows
+        sums = self.sum_by(store.confusion_id[rows], store.confusion_counts[rows], len(store.confusion_keys))
+        present = np.bincount(store.confusion_id[rows], minlength=len(store.confusion_keys)) > 0
+        order = sorted(np.flatnonzero(present), key=store.confusion_keys.__getitem__)
+        grnd_to_ocr_df_agg = pd.DataFrame({"Ground_Truth": [store.confusion_keys[i][0] for i in order],
+                                           "OCR_Output": [store.confusion_keys[i][1] for i in order]},
+                                          columns=["Ground_Truth", "OCR_Output"])
+        for column, name in enumerate(CONFUSION_COUNT_COLUMNS):
+            grnd_to_ocr_df_agg[name] = sums[order, column]
+        grnd_to_ocr_df_agg = grnd_to_ocr_df_agg[grnd_to_ocr_df_agg.total_occurances != 0].copy()
+        grnd_to_ocr_df_agg["Total_Combo_by_total_occurances"] = grnd_to_ocr_df_agg["total_combo"] / grnd_to_ocr_df_agg["total_occurances"]
+        return grnd_to_ocr_df_agg
+
+    def err_rate_per_doc_df(self):
+        store = self.store
+        counts = store.char_counts[self.char_rows]
+        doc = store.char_doc[self.char_rows]
+        errors = np.bincount(doc, weights=counts[:, :3].sum(axis=1), minlength=len(store.documents))
+        totals = np.bincount(doc, weights=counts[:, 3], minlength=len(store.documents))
+        order = sorted(np.flatnonzero(self.doc_mask), key=store.documents.__getitem__)
+        return pd.DataFrame({"filename": [store.documents[i] for i in order], "CER": errors[order] / totals[order], "Characters": totals[order]},
+                            columns=["filename", "CER", "Characters"])
+
+    def cer(self):
+        # aggregated over the selected documents, as in the aggregated report
+        err_rate_per_char_df_agg = self.err_rate_per_char_df()
+        return ocr_stats.aggregated_rate(err_rate_per_char_df_agg[["Substitutions", "Insertions", "Deletions"]].values,
+                                         err_rate_per_char_df_agg["Total"].values)
+
+    def top_confusions(self, k=20):
+        return self.grnd_to_ocr_df().sort_values(["total_combo", "Ground_Truth", "OCR_Output"], ascending=[False, True, True]).head(k)
+# end
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store_path", type=str, help="<tool>_results.npz written next to the aggregated report")
+    parser.add_argument("--documents", type=str, action="append", default=[], help="only documents whose report filename matches this glob, repeat for more")
+    parser.add_argument("--top_confusions", type=int, default=None, help="print the K most frequent confusions")
+    parser.add_argument("--char_rates", action="store_true", help="print the error rate per character")
+    parser.add_argument("--per_document", action="store_true", help="print the cer per document")
+    parser.add_argument("--report", type=str, default=None, help="write the aggregated report for the selected documents to this directory")
+    parser.add_argument("--tool", type=str, default=None, help="tool label of the regenerated report, the stored one by default")
+    parser.add_argument("--plotly_uname", type=str, default=None)
+    parser.add_argument("--plotly_api_key", type=str, default=None)
+    parser.add_argument("--max_rows_per_page", type=int, default=None)
+    parser.add_argument("--bootstrap_resamples", type=int, default=ocr_stats.BOOTSTRAP_RESAMPLES)
+    return parser.parse_args()
+# end
+
+if __name__ == "__main__":
+    args = get_args()
+    store = ResultsStore(args.store_path)
+    view = store.view(args.documents)
+    num_docs = int(np.count_nonzero(view.doc_mask))
+    if num_docs == 0:
+        sys.exit("no document in {} matches {}".format(args.store_path, args.documents))
+    print("{}: {} of {} documents, aggregated cer {}".format(store.tool, num_docs, len(store.documents), view.cer()))
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        if args.per_document:
+            print(view.err_rate_per_doc_df().to_string(index=False))
+        if args.char_rates:
+            print(view.err_rate_per_char_df().to_string(index=False))
+        if args.top_confusions is not None:
+            print(view.top_confusions(args.top_confusions).to_string(index=False))
+    if args.report is not None:
+        import ocr_report_generator as report_generator
+        if not os.path.exists(args.report):
+            os.makedirs(args.report)
+        report_generator.create_reports(None, args.report, args.tool or store.tool, args.plotly_uname, args.plotly_api_key,
+                                        max_rows_per_page=args.max_rows_per_page, aggregator=view, num_resamples=args.bootstrap_resamples)
+        print("aggregated report: {}".format(os.path.join(args.report, "{}_aggregated_report.html".format(args.tool or store.tool))))
@@ -0,0 +1,166 @@
+import os
+import time
+import heapq
+import itertools
+import signal
+import threading
+import subprocess
+
+class EvalJob(object):
+    # one truth/test pair, sized by its input files so the longest documents can go first
+
+    def __init__(self, truth_test_output_w_paths):
+        self.paths = truth_test_output_w_paths
+        self.size = sum(os.path.getsize(path) for path in truth_test_output_w_paths[:2])
+        self.attempts = 0
+        self.seconds = 0.0
+        self.error = None
+# end
+
+def make_jar_args(truth_test_output_w_paths, jar_path, max_heap_mb=None):
+    args = ["java"]
+    if max_heap_mb:
+        # an oversized document ends the jvm with an OutOfMemoryError instead of taking the machine
+        args.append("-Xmx{}m".format(max_heap_mb))
+    return args + ["-cp", jar_path, "eu.digitisation.Main", "-gt", truth_test_output_w_paths[0],
+                   "-ocr", truth_test_output_w_paths[1], "-o", truth_test_output_w_paths[2]]
+# end
+
+def run_job(args, log_path, timeout=None):
+    # stdout and stderr go straight to the log file, so nothing piles up in a pipe the jvm could
+    # block on. returns None on success or why the job failed
+    with open(log_path, "ab") as log_file:
+        log_file.write("$ {}\n".format(" ".join(args)).encode("utf-8"))
+        log_file.flush()
+        proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # the whole process group, in case the jvm started anything of its own
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                # the group exited in the meantime
+                pass
+            proc.wait()
+            return "timed out after {}s".format(timeout)
+    if returncode != 0:
+        return "exit status {}".format(returncode)
+    return None
+# end
+
+class EvalScheduler(object):
+    # runs the jar once per pair from a fixed number of threads, largest pairs first. failed pairs
+    # are retried after an exponential backoff and quarantined once they run out of retries
+
+    def __init__(self, num_workers, jar_path, log_dir, timeout=None, max_heap_mb=None, retries=2, backoff=2.0,
+                 progress_interval=10.0, quarantine_path=None):
+        self.num_workers = num_workers
+        self.jar_path = jar_path
+        self.log_dir = log_dir
+        self.timeout = timeout
+        self.max_heap_mb = max_heap_mb
+        self.retries = retries
+        self.backoff = backoff
+        self.progress_interval = progress_interval
+        self.quarantine_path = quarantine_path
+        self.quarantined = [] # failed jobs, filled in as the run goes so reports can refer to it up front
+        self.condition = threading.Condition()
+
+    def run(self, all_truth_test_output_w_paths):
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        jobs = sorted((EvalJob(paths) for paths in all_truth_test_output_w_paths), key=lambda job: job.size, reverse=True)
+        # (not before, largest first, submission order, job)
+        self.sequence = itertools.count()
+        self.pending = [(0.0, -job.size, next(self.sequence), job) for job in jobs]
+        heapq.heapify(self.pending)
+        self.num_running = 0
+        self.num_done = 0
+        self.num_retried = 0
+        self.total_bytes = sum(job.size for job in jobs)
+        self.done_bytes = 0
+        self.start_time = time.time()
+        self.last_progress = self.start_time
+
+        threads = [threading.Thread(target=self.work) for _ in range(min(self.num_workers, len(jobs)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.print_progress(final=True)
+        if self.quarantine_path is not None:
+            write_quarantine(self.quarantine_path, self.quarantined)
+        return jobs
+
+    def next_job(self):
+        with self.condition:
+            while True:
+                if self.pending:
+                    delay = self.pending[0][0] - time.time()
+                    if delay <= 0:
+                        self.num_running += 1
+                        return heapq.heappop(self.pending)[-1]
+                    self.condition.wait(delay)
+                elif self.num_running == 0:
+                    return None
+                else:
+                    # a running job may still come back for a retry
+                    self.condition.wait()
+
+    def work(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            job.attempts += 1
+            start = time.time()
+            log_path = os.path.join(self.log_dir, os.path.splitext(os.path.basename(job.paths[2]))[0] + ".log")
+            # a job that cannot even be started (no java on the path, log not writable) still has to
+            # be finished, or the other workers wait on it forever
+            try:
+                error = run_job(make_jar_args(job.paths, self.jar_path, self.max_heap_mb), log_path, self.timeout)
+                if error is None and not os.path.isfile(job.paths[2]):
+                    error = "no report written"
+            except Exception as e:
+                error = "{}: {}".format(type(e).__name__, e)
+            job.seconds += time.time() - start
+            self.finish(job, error)
+
+    def finish(self, job, error):
+        with self.condition:
+            self.num_running -= 1
+            job.error = error
+            if error is None:
+                self.num_done += 1
+                self.done_bytes += job.size
+            elif job.attempts <= self.retries:
+                self.num_retried += 1
+                heapq.heappush(self.pending, (time.time() + self.backoff*2**(job.attempts - 1), -job.size, next(self.sequence), job))
+            else:
+                # whatever a failed attempt left behind must not end up in the aggregated report
+                if os.path.exists(job.paths[2]):
+                    os.remove(job.paths[2])
+                self.quarantined.append(job)
+                print("quarantined {} after {} attempts: {}".format(job.paths[1], job.attempts, error))
+            if time.time() - self.last_progress >= self.progress_interval:
+                self.print_progress()
+            self.condition.notify_all()
+
+    def print_progress(self, final=False):
+        # eta from the bytes still to go at the rate so far
+        self.last_progress = time.time()
+        elapsed = self.last_progress - self.start_time
+        remaining_bytes = self.total_bytes - self.done_bytes - sum(job.size for job in self.quarantined)
+        eta = elapsed*remaining_bytes/self.done_bytes if self.done_bytes else float("nan")
+        print("evaluated {} pairs, {} quarantined, {} retries, {:.0f}s elapsed{}".format(
+              self.num_done, len(self.quarantined), self.num_retried, elapsed,
+              "" if final else ", about {:.0f}s to go".format(eta)))
+# end
+
+def write_quarantine(quarantine_path, quarantined):
+    with open(quarantine_path, "w") as quarantine_file:
+        quarantine_file.write("truth\ttest\tattempts\treason\n")
+        for job in quarantined:
+            quarantine_file.write("{}\t{}\t{}\t{}\n".format(job.paths[0], job.paths[1], job.attempts, job.error))
+# end
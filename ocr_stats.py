@@ -0,0 +1,161 @@
+import numpy as np
+
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_SEED = 0
+# upper bound on resampled values held at once, batches shrink as the corpus grows
+BOOTSTRAP_BATCH_VALUES = 1 << 22
+
+def as_array(values):
+    return np.asarray(values, dtype=np.float64)
+# end
+
+def weighted_mean(x, weights=None):
+    x = as_array(x)
+    if weights is None:
+        return float(np.mean(x))
+    weights = as_array(weights)
+    return float(np.dot(weights, x) / np.sum(weights))
+# end
+
+def weighted_variance(x, weights=None):
+    # population variance, the mean square difference from the (weighted) mean
+    x = as_array(x)
+    mean = weighted_mean(x, weights)
+    if weights is None:
+        return float(np.mean((x - mean)**2))
+    weights = as_array(weights)
+    return float(np.dot(weights, (x - mean)**2) / np.sum(weights))
+# end
+
+def weighted_quantiles(x, quantiles, weights=None):
+    # unweighted quantiles interpolate linearly like numpy's default. weighted ones place each value
+    # at the middle of its share of the cumulative weight and interpolate between those
+    x = as_array(x)
+    quantiles = as_array(quantiles)
+    if weights is None:
+        return np.percentile(x, quantiles*100)
+    weights = as_array(weights)
+    order = np.argsort(x, kind="mergesort")
+    x = x[order]
+    weights = weights[order]
+    positions = (np.cumsum(weights) - 0.5*weights) / np.sum(weights)
+    return np.interp(quantiles, positions, x)
+# end
+
+def error_rates(errors, totals):
+    # per row rates of count columns, e.g. substitutions + insertions + deletions over total per character
+    return as_array(errors) / as_array(totals)
+# end
+
+def aggregated_rate(errors, totals):
+    return float(np.sum(as_array(errors)) / np.sum(as_array(totals)))
+# end
+
+def defined_mask(x):
+    # documents without ground truth characters have a nan or inf rate and are left out of the stats
+    return np.isfinite(as_array(x))
+# end
+
+def sigma_mask(x, num_std, weights=None):
+    # values strictly within num_std standard deviations of the mean of the defined values
+    x = as_array(x)
+    defined = defined_mask(x)
+    if not defined.any():
+        return defined
+    mean = weighted_mean(x[defined], None if weights is None else as_array(weights)[defined])
+    std = np.sqrt(weighted_variance(x[defined], None if weights is None else as_array(weights)[defined]))
+    return (x > mean - num_std*std) & (x < mean + num_std*std)
+# end
+
+def iqr_mask(x, k=1.5, weights=None):
+    # values within k interquartile ranges of the quartiles (tukey's fences) of the defined values
+    x = as_array(x)
+    defined = defined_mask(x)
+    if not defined.any():
+        return defined
+    q1, q3 = weighted_quantiles(x[defined], [0.25, 0.75], None if weights is None else as_array(weights)[defined])
+    iqr = q3 - q1
+    return (x >= q1 - k*iqr) & (x <= q3 + k*iqr)
+# end
+
+def resample_counts(rng, num_docs, num_resamples):
+    # how often each document is drawn in each resample, one row per resample
+    idx = rng.randint(0, num_docs, size=(num_resamples, num_docs))
+    idx += np.arange(num_resamples)[:, None]*num_docs
+    return np.bincount(idx.ravel(), minlength=num_resamples*num_docs).reshape(num_resamples, num_docs)
+# end
+
+def counts_median(sorted_x, counts):
+    # median of each resample from its counts over the sorted values, as np.median of the drawn values
+    num_docs = len(sorted_x)
+    cumulative = np.cumsum(counts, axis=1)
+    low = np.array([np.searchsorted(row, (num_docs - 1) // 2, side="right") for row in cumulative])
+    high = np.array([np.searchsorted(row, num_docs // 2, side="right") for row in cumulative])
+    return (sorted_x[low] + sorted_x[high]) / 2
+# end
+
+def bootstrap_cis(x, weights=None, num_resamples=BOOTSTRAP_RESAMPLES, confidence=0.95, seed=BOOTSTRAP_SEED):
+    # percentile intervals of the mean, median and, given weights, weighted mean over resamples of the
+    # documents. all three come from the same resamples, drawn a batch at a time as count matrices so
+    # each statistic is one matrix product or cumulative sum per batch
+    x = as_array(x)
+    names = ["mean", "median"] + (["weighted_mean"] if weights is not None else [])
+    if len(x) == 0 or num_resamples <= 0:
+        return dict((name, (float("nan"), float("nan"))) for name in names)
+    order = np.argsort(x, kind="mergesort")
+    x = x[order]
+    if weights is not None:
+        weights = as_array(weights)[order]
+    rng = np.random.RandomState(seed)
+    batch_size = max(1, BOOTSTRAP_BATCH_VALUES // len(x))
+    values = dict((name, np.empty(num_resamples)) for name in names)
+    for start in range(0, num_resamples, batch_size):
+        stop = min(num_resamples, start + batch_size)
+        counts = resample_counts(rng, len(x), stop - start)
+        values["median"][start:stop] = counts_median(x, counts)
+        # float products go through blas
+        counts = counts.astype(np.float64)
+        values["mean"][start:stop] = counts.dot(x) / len(x)
+        if weights is not None:
+            values["weighted_mean"][start:stop] = counts.dot(weights*x) / counts.dot(weights)
+    alpha = (1 - confidence) / 2
+    return dict((name, tuple(map(float, np.percentile(values[name], [alpha*100, (1 - alpha)*100])))) for name in names)
+# end
+
+def corpus_stats(cer, weights=None, num_resamples=BOOTSTRAP_RESAMPLES, confidence=0.95, seed=BOOTSTRAP_SEED):
+    # cer: per document error rates, weights: per document character totals. the weighted mean of the
+    # document rates is the aggregated rate, so its interval is the one of the aggregated CER.
+    # num_docs counts the documents with a defined rate, num_undefined the ones left out
+    cer = as_array(cer)
+    defined = defined_mask(cer)
+    stats = {"num_docs": int(np.count_nonzero(defined)), "num_undefined": int(len(cer) - np.count_nonzero(defined)),
+             "confidence": confidence, "num_resamples": num_resamples}
+    cer = cer[defined]
+    if weights is not None:
+        weights = as_array(weights)[defined]
+    if len(cer) == 0:
+        nan = float("nan")
+        stats.update({"pop_mean": nan, "pop_msd": nan, "pop_std": nan, "min": nan, "q1": nan, "median": nan, "q3": nan, "max": nan, "iqr": nan,
+                      "mean_ci": (nan, nan), "median_ci": (nan, nan), "outliers_1std": 0, "outliers_2std": 0, "outliers_iqr": 0})
+        if weights is not None:
+            stats.update({"weighted_mean": nan, "weighted_msd": nan, "weighted_std": nan, "weighted_median": nan, "weighted_mean_ci": (nan, nan)})
+        return stats
+    stats["pop_mean"] = weighted_mean(cer)
+    stats["pop_msd"] = weighted_variance(cer)
+    stats["pop_std"] = float(np.sqrt(stats["pop_msd"]))
+    stats["min"], stats["q1"], stats["median"], stats["q3"], stats["max"] = map(float, weighted_quantiles(cer, [0, 0.25, 0.5, 0.75, 1]))
+    stats["iqr"] = stats["q3"] - stats["q1"]
+    cis = bootstrap_cis(cer, weights, num_resamples, confidence, seed)
+    stats["mean_ci"] = cis["mean"]
+    stats["median_ci"] = cis["median"]
+    stats["outliers_1std"] = int(len(cer) - np.count_nonzero(sigma_mask(cer, 1)))
+    stats["outliers_2std"] = int(len(cer) - np.count_nonzero(sigma_mask(cer, 2)))
+    stats["outliers_iqr"] = int(len(cer) - np.count_nonzero(iqr_mask(cer)))
+    if weights is not None:
+        stats["weighted_mean"] = weighted_mean(cer, weights)
+        stats["weighted_msd"] = weighted_variance(cer, weights)
+        stats["weighted_std"] = float(np.sqrt(stats["weighted_msd"]))
+        stats["weighted_median"] = float(weighted_quantiles(cer, [0.5], weights)[0])
+        stats["weighted_mean_ci"] = cis["weighted_mean"]
+    return stats
+# end